@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# benchmark.py - Measure how ogg2gme.py scales: Build synthetic projects and time
+#                each build phase. Results are written as JSON.
+
+import optparse
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import platform
+
+# Directory containing the benchmark.py and ogg2gme.py scripts.
+scriptDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDir)
+import ogg2gme
+
+
+# Stub tools for --stub. They produce files of the right names and formats, but
+# do no real work, so the benchmark runs offline without tttool and ImageMagick.
+stubTttool = '''
+import sys, os, re, zlib, struct
+
+def writePng(fileName, size, code):
+    """Write RGBA PNG with a code dependent dot pattern on transparent background."""
+    rows = []
+    for y in range(size):
+        row = bytearray(size * 4)
+        if y % 8 == 0:
+            for x in range((y + code) % 16, size, 16):
+                row[x * 4 + 3] = 255
+        rows.append("\\0" + str(row))
+    chunk = lambda t, d: struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d) & 0xffffffff)
+    f = open(fileName, "wb")
+    f.write("\\x89PNG\\r\\n\\x1a\\n" + chunk("IHDR", struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0)) +
+            chunk("IDAT", zlib.compress("".join(rows))) + chunk("IEND", ""))
+    f.close()
+
+def readCodes(yamlFileName):
+    """Read product-id and script names from yaml and assign codes like tttool."""
+    text = open(yamlFileName).read().replace("\\r", "")
+    productId = int(re.search("^product-id: *([0-9]+)", text, re.M).group(1))
+    names = re.findall("^  ([A-Za-z0-9][A-Za-z0-9_]*):", text.split("scripts:", 1)[1], re.M)
+    codesYamlFileName = yamlFileName[:-5] + ".codes.yaml"
+    codes = {}
+    if os.path.exists(codesYamlFileName):
+        for (name, code) in re.findall("^  ([^:]+): *([0-9]+)", open(codesYamlFileName).read(), re.M):
+            codes[name] = int(code)
+    nextCode = max(codes.values() + [1000]) + 1
+    for name in names:
+        if name not in codes:
+            codes[name] = nextCode
+            nextCode += 1
+    open(codesYamlFileName, "w").write("scriptcodes:\\n" + "".join(["  %s: %d\\n" % x for x in sorted(codes.items())]))
+    return (productId, codes)
+
+args = sys.argv[1:]
+if args[0] == "assemble":
+    (productId, codes) = readCodes(args[1])
+    open(args[1][:-5] + ".gme", "wb").write(os.urandom(1024))
+elif args[0] == "oid-code":
+    dpi = args[args.index("-d") + 1]
+    size = 800 if dpi.startswith("1200") else 400
+    for part in args[-1].split(","):
+        (start, end) = (part.split("-") + [part])[:2]
+        for code in range(int(start), int(end) + 1):
+            writePng("oid-%d.png" % code, size, code)
+else:
+    sys.exit("stub tttool: unsupported command " + args[0])
+'''
+
+stubImageMagick = '''
+import sys, zlib, struct
+chunk = lambda t, d: struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d) & 0xffffffff)
+f = open(sys.argv[-1], "wb")
+f.write("\\x89PNG\\r\\n\\x1a\\n" + chunk("IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)) +
+        chunk("IDAT", zlib.compress("\\0\\xff\\xff\\xff")) + chunk("IEND", ""))
+f.close()
+'''
+
+
+def writeStubTools(binDir):
+    """Write stub tttool, convert and montage executables into binDir.
+    """
+    for (name, source) in (("tttool", stubTttool), ("convert", stubImageMagick), ("montage", stubImageMagick)):
+        fileName = binDir + os.sep + name
+        f = open(fileName, "w")
+        f.write("#!" + sys.executable + "\n" + source)
+        f.close()
+        os.chmod(fileName, 0755)
+
+
+def createProject(projectDir, numSamples, numYamlScripts):
+    """Create synthetic project with numSamples samples, numYamlScripts of them already in the *.yaml file.
+    """
+    os.mkdir(projectDir)
+    sample = ogg2gme.dataDir + os.sep + "STOP.ogg"
+    shutil.copyfile(sample, projectDir + os.sep + "_welcome.ogg")
+    for i in range(numSamples):
+        shutil.copyfile(sample, projectDir + os.sep + "sample%05d.ogg" % i)
+    if numYamlScripts:
+        scripts = ["  sample%05d:\n  - P(sample%05d)\n" % (i, i) for i in range(min(numYamlScripts, numSamples))]
+        ogg2gme.writeStringToFile(projectDir + os.sep + "_" + os.path.basename(projectDir) + ".yaml",
+                                  "product-id: 950\nwelcome: _welcome\nscripts:\n" + "".join(scripts))
+
+
+def parseList(s):
+    """Parse comma separated list of integers.
+    """
+    return [int(x) for x in s.split(",") if x]
+
+
+def main():
+    usage = """Usage: %prog [options]
+
+Build synthetic projects with ogg2gme.py and time each build phase (YAML read/merge,
+tttool assemble, OID generation, boxes, labels and pages) for all combinations of
+--samples, --yaml-scripts and --config. Each combination is built twice: A cold
+build (--force) and a warm rebuild without changes. Results are written as JSON.
+
+With --stub tttool, convert and montage are replaced by stubs, so the benchmark
+runs offline on any Linux box. (Phase times then mostly reflect ogg2gme.py itself.)
+"""
+    parser = optparse.OptionParser(usage=usage, version=ogg2gme.version)
+    parser.add_option("-n", "--samples",  type=str, default="10,100,1000", help="Comma separated list of numbers of samples per project. Default is %default.")
+    parser.add_option("-y", "--yaml-scripts",  type=str, default="0", help="Comma separated list of numbers of scripts which already exist in the *.yaml file (at most the number of samples). Default is %default.")
+    parser.add_option("-c", "--config",  action="append", default=[], help="Layout SHAPE,DPI,COLUMNS passed to --shape, --dpi and --num-columns. May be given multiple times. Default is box,600d,3.")
+    parser.add_option("-r", "--renderer",  type=str, default="auto", help="--renderer for ogg2gme.py. Default is %default.")
+    parser.add_option("-j", "--jobs",  type=int, default=ogg2gme.getNumCpus(), help="--jobs for ogg2gme.py. Default is %default.")
+    parser.add_option("-s", "--stub",  default=False, action="store_true", help="Use stub tttool, convert and montage.")
+    parser.add_option("-o", "--output",  type=str, default="", help="Write JSON results to this file. Default is stdout.")
+    parser.add_option("-k", "--keep",  default=False, action="store_true", help="Keep the synthetic project directories.")
+    (options, args) = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Not expecting any non-option args.")
+    configs = [x.split(",") for x in options.config] or [["box", "600d", "3"]]
+    for config in configs:
+        if len(config) != 3:
+            parser.error("--config must be SHAPE,DPI,COLUMNS.")
+
+    workDir = tempfile.mkdtemp(prefix="ogg2gme-benchmark-")
+    path = os.environ["PATH"]
+    results = []
+    try:
+        if options.stub:
+            binDir = workDir + os.sep + "bin"
+            os.mkdir(binDir)
+            writeStubTools(binDir)
+            os.environ["PATH"] = binDir + os.pathsep + path
+        for numSamples in parseList(options.samples):
+            for numYamlScripts in parseList(options.yaml_scripts):
+                for (shape, dpi, columns) in configs:
+                    projectDir = workDir + os.sep + "p950_bench%d" % len(results)
+                    createProject(projectDir, numSamples, numYamlScripts)
+                    config = {"build_oid_table": True, "shape": shape, "dpi": dpi, "num_columns": int(columns), "renderer": options.renderer, "jobs": options.jobs,
+                              "cache_dir": os.path.join(workDir, "cache")}
+                    result = {"samples": numSamples, "yaml_scripts": min(numYamlScripts, numSamples), "shape": shape, "dpi": dpi,
+                              "columns": int(columns), "renderer": options.renderer, "jobs": options.jobs}
+                    for (run, force) in (("cold", True), ("warm", False)):
+                        if force:
+                            # Cold builds start with an empty machine-wide cache (and never touch the one of the user).
+                            shutil.rmtree(config["cache_dir"], True)
+                        build = ogg2gme.Project(projectDir, ogg2gme.BuildConfig(force=force, **config)).build()
+                        result[run] = {"phases": build.phaseTimes, "total": build.seconds}
+                    sys.stderr.write("%5d samples, %5d yaml scripts, %s: cold %.2fs, warm %.2fs\n" %
+                                     (numSamples, result["yaml_scripts"], ",".join((shape, dpi, columns)), result["cold"]["total"], result["warm"]["total"]))
+                    results.append(result)
+                    if not options.keep:
+                        shutil.rmtree(projectDir)
+    finally:
+        os.environ["PATH"] = path
+        if not options.keep:
+            shutil.rmtree(workDir)
+        else:
+            sys.stderr.write("Keeping %s\n" % workDir)
+
+    report = {"version": ogg2gme.version, "python": platform.python_version(), "platform": platform.platform(),
+              "cpus": ogg2gme.getNumCpus(), "stub": options.stub, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    s = json.dumps(report, indent=1, sort_keys=True) + "\n"
+    if options.output:
+        ogg2gme.writeStringToFile(options.output, s)
+    else:
+        sys.stdout.write(s)
+
+
+# call main()
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,54 @@ import glob
 import os
 import re
 import shutil
+import multiprocessing
+import hashlib
+import json
+import distutils.spawn
+import subprocess
+import time
+import struct
+import errno
+import zlib
+import math
+import mmap
+import select
+import ctypes
+import ctypes.util
+import threading
+import fnmatch
+import base64
+import StringIO
+import xml.sax.saxutils
+import tempfile
+import zipfile
+import tarfile
+import urllib
+import urlparse
+import Queue
+import SocketServer
+import BaseHTTPServer
+from multiprocessing.pool import ThreadPool
 
-version = "0.1.10"
+# The resource module is not available on Windows. It is only used by --profile.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The Python Imaging Library (Pillow) is optional. It enables --renderer native.
+try:
+    from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# NumPy is optional. Together with Pillow it enables --oid-generator native.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+version = "0.1.33"
 
 # Changes:
 # v0.1.3:
@@ -24,6 +70,29 @@ version = "0.1.10"
 # 2016-12-05: v0.1.8 Added --num-normal-oid to print a page full of power-on-symbols.
 # 2018-03-29: v0.1.9 Added custom box shapes.
 # 2018-03-31: v0.1.10 Fixed blurred start symbol in Word. (Hopefully. Start and stop Symbol now have just 3 colors plus transparency.)
+# 2026-10-18: v0.1.11 Added --jobs: Run the box, label and page commands of -t in parallel.
+# 2026-10-18: v0.1.12 Added --renderer native: Render boxes and labels in Python using Pillow (if installed).
+# 2026-10-18: v0.1.13 -t only regenerates OID patterns, boxes and labels whose inputs changed.
+# 2026-10-18: v0.1.14 Generate all missing OID patterns with a single tttool oid-code call.
+# 2026-10-18: v0.1.15 Skip tttool assemble and -t when their inputs did not change. Added --force and --checksum.
+# 2026-10-18: v0.1.16 Added --batch to build all projects below a directory in parallel.
+# 2026-10-18: v0.1.17 Parse *.yaml files in linear time (speedup for projects with many scripts).
+# 2026-10-18: v0.1.18 --renderer native also composes the label pages, strip by strip with bounded memory.
+# 2026-10-18: v0.1.19 Added --transcode to convert *.wav, *.flac and *.mp3 files into *.ogg files.
+# 2026-10-18: v0.1.20 Record the wall time of each build phase. Added benchmark.py.
+# 2026-10-18: v0.1.21 Added --profile and --trace.
+# 2026-10-18: v0.1.22 Added --watch.
+# 2026-10-18: v0.1.23 Added --dedup-audio.
+# 2026-10-18: v0.1.24 Resize shapes and extract their masks only once, into a machine-wide cache. Added --cache-dir and --cache-size.
+# 2026-10-18: v0.1.25 Added Project and BuildConfig to build projects from Python (also concurrently from threads) without changing the current directory.
+# 2026-10-18: v0.1.26 Added --serve: Local HTTP build service with a job queue and a pool of worker threads.
+# 2026-10-18: v0.1.27 Added --output-format pdf and svg: Vector OID tables at exact physical size.
+# 2026-10-18: v0.1.28 Run tttool assemble concurrently with the OID table when the codes are known. Chain each label to its box.
+# 2026-10-18: v0.1.29 Patch changed audio files into the *.gme file instead of running tttool assemble. Added --verify-patch.
+# 2026-10-18: v0.1.30 Added --layout pack: Pack labels as wide as their box and text into as few pages as possible.
+# 2026-10-18: v0.1.31 Keep the oid-code images of tttool in the machine-wide cache, so each OID is generated only once per machine.
+# 2026-10-18: v0.1.32 Added --compact-png: Write boxes, labels and pages as 1 bit or palette PNG files where this is exact.
+# 2026-10-18: v0.1.33 Added --oid-generator: Generate the OID patterns natively with NumPy, without tttool oid-code.
     
 
 # Directory containing the ogg2gme.py script.
@@ -47,6 +116,15 @@ def isWindows():
     return os.name == "nt"
 
 
+def getNumCpus():
+    """Return the number of CPU cores, or 1 if it cannot be determined.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 def isdigit(char):
     """Return True iff char is a digit.
     """
@@ -88,31 +166,34 @@ def readStringFromFile(fileName):
     f.close()
     return r
 
-def getParentDirName():
-    """Return name of the parent directory.
+def getProjectPath(projectDir, fileName):
+    """Return path of fileName in projectDir. (Just fileName for the current directory.)
     """
-    return os.path.basename(os.getcwd())
+    return os.path.normpath(os.path.join(projectDir, fileName))
 
 
-def findFileInParentDirs(fileName, notFound):
-    """Find file in parent dirs. If not found return notFound.
-    """    
-    if os.path.exists(fileName):
-        return "./" + fileName 
+def getProjectDirName(projectDir):
+    """Return name of the project directory.
+    """
+    return os.path.basename(os.path.abspath(projectDir))
 
-    for i in range(10):
-        fileName = "../" + fileName
-        if os.path.exists(fileName):
-            return fileName
+
+def findFileInParentDirs(fileName, notFound, startDir):
+    """Find file in startDir and its parent dirs and return its absolute path. If not found return notFound.
+    """    
+    for i in range(11):
+        path = os.path.join(startDir, *([".."] * i + [fileName]))
+        if os.path.exists(path):
+            return os.path.abspath(path)
         
     return notFound
 
 
-def getYamlFileNames():
-    """Get filenames of the *.yaml and *.codes.yaml filenames.
+def getYamlFileNames(projectDir):
+    """Get filenames of the *.yaml and *.codes.yaml filenames in projectDir.
     Return (yamlFileName, codesYamlFileName). codesYamlFileName may be None.
     """
-    fileList = glob.glob("*.yaml")
+    fileList = glob.glob(getProjectPath(projectDir, "*.yaml"))
     yamlList = [x for x in fileList if not x.endswith(".codes.yaml")]
     codesYamlList = [x for x in fileList if x.endswith(".codes.yaml")]
     if len(yamlList) == 1 and len(codesYamlList) == 1:
@@ -120,16 +201,27 @@ def getYamlFileNames():
     if len(yamlList) == 1 and len(codesYamlList) == 0:
         return (yamlList[0], yamlList[0][:-5] + ".codes.yaml")
     if len(yamlList) == 0 and len(codesYamlList) == 0:
-        dirname = getParentDirName()
-        return ("_" + dirname + ".yaml", "_" + dirname + ".codes.yaml")
+        dirname = getProjectDirName(projectDir)
+        return (getProjectPath(projectDir, "_" + dirname + ".yaml"), getProjectPath(projectDir, "_" + dirname + ".codes.yaml"))
     raise Error("Expecting 0, 1 or 2 yaml files (one foo.yaml and optionally one foo.codes.yaml).")
 
 
-def getProductId():
+def getProductIdFromDirName(dirname):
+    """Return product id of a directory name of the format 'p900_my_book' or None.
+    """
+    if len(dirname) >= 2 and dirname[0] == 'p' and isdigit(dirname[1]):
+        end = 1
+        while end < len(dirname) and isdigit(dirname[end]):
+            end += 1
+        return int(dirname[1:end])
+    return None
+
+
+def getProductId(projectDir):
     """Get and retrn product-id.
     
     The product id is either directly specified by the --product-id option
-    or is determined by the name of the current directory which 
+    or is determined by the name of the project directory which 
     must be of the format 'p900_my_book' for product id 900 for example.
     """
     # If --product-id is specified always use this.
@@ -137,20 +229,16 @@ def getProductId():
         return options.product_id
     
     # Try to get product id from directory name.
-    dirname = getParentDirName()
-    if len(dirname) >= 2 and dirname[0] == 'p' and isdigit(dirname[1]):
-        end = 1
-        while end < len(dirname) and isdigit(dirname[end]):
-            end += 1
-        productId = int(dirname[1:end])
+    productId = getProductIdFromDirName(getProjectDirName(projectDir))
+    if productId is not None:
         return productId
-    raise Error("Unable to determine product-id. Either prepend a p<PRODUCTID> prefix to the name of the current directory or specify --product-id.")
+    raise Error("Unable to determine product-id. Either prepend a p<PRODUCTID> prefix to the name of the project directory or specify --product-id.")
 
 
 def readOrGenerateYaml(yamlFileName, productId):
     """Read *.yaml file. Generate it if it is missing.
     
-    Return (usedScriptNames, yamlHead, yamlTail).
+    Return (usedScriptNames, yamlHead, yamlTail). usedScriptNames is a set.
     """
     # Generate empty yaml file if necessary.
     if not os.path.exists(yamlFileName):
@@ -161,58 +249,172 @@ welcome: _welcome
 scripts:
 """ % productId
         writeStringToFile(yamlFileName, yaml)
+        addWrittenFiles([yamlFileName])
     
     # Read yaml file.
     if options.verbose:
         print "Reading YAML file %s" % (yamlFileName)
     s = readStringFromFile(yamlFileName).replace("\r", "")
     lines = s.splitlines()
-    usedScriptNames = []
-    yamlHead = []
-    yamlTail = []
+    numLines = len(lines)
+    usedScriptNames = set()
     
     # Parse part before and including 'scripts:' line.
-    while lines and lines[0].rstrip() != "scripts:":
-        yamlHead.append(lines.pop(0))
-    if lines:
-        yamlHead.append(lines.pop(0))
+    i = 0
+    while i < numLines and lines[i].rstrip() != "scripts:":
+        i += 1
+    if i < numLines:
+        i += 1
 
     # Parse scripts.
-    while lines and (len(lines[0].strip()) == 0 or lines[0].strip().startswith("#") or lines[0].startswith("  ")):
-        line = lines.pop(0)
-        yamlHead.append(line)        
-        scriptName = line.strip()
+    while i < numLines and (len(lines[i].strip()) == 0 or lines[i].strip().startswith("#") or lines[i].startswith("  ")):
+        scriptName = lines[i].strip()
+        i += 1
         if scriptName.startswith("#"):
             continue
         if scriptName and scriptName.endswith(":") and isalnum(scriptName[0]):
-            usedScriptNames.append(scriptName[:-1])
+            usedScriptNames.add(scriptName[:-1])
+    yamlHead = lines[:i]
     if yamlHead:
         yamlHead[-1] += "\n"
         
     # Parse rest.
-    yamlTail = lines
+    yamlTail = lines[i:]
     if yamlTail:
         yamlTail[-1] += "\n"
         
     return (usedScriptNames, "\n".join(yamlHead), "\n".join(yamlTail))
 
 
-def getListOfAudioFiles():
-    """Scan current directory and return list of audio (*.ogg) files without 
-    filename extension.
+# Audio files which are transcoded into *.ogg files by --transcode.
+audioSourcePatterns = ["*.wav", "*.flac", "*.mp3"]
+audioCacheDir = ".ogg2gme-cache/audio"
+
+# Encoder commands for --transcode: Mono, 22050 Hz Ogg Vorbis (like the recommended Audacity settings).
+encoderCommands = {
+    "ffmpeg": 'ffmpeg -v error -y -i "%(src)s" -ac 1 -ar 22050 -c:a libvorbis -q:a %(quality)s "%(dst)s"',
+    "sox":    'sox "%(src)s" -c 1 -r 22050 -C %(quality)s "%(dst)s"',
+    "oggenc": 'oggenc -Q --downmix --resample 22050 -q %(quality)s -o "%(dst)s" "%(src)s"',
+}
+
+
+def checkAudioQuality(quality):
+    """Raise Error unless quality (--audio-quality) is a number. It is part of the encoder commands.
+    """
+    if not re.match(r"-?[0-9]+(\.[0-9]+)?$", quality):
+        raise Error("--audio-quality must be a number (-1 to 10), not '%s'." % quality)
+
+
+def getEncoderCommand():
+    """Return encoder command template selected by --encoder.
+    """
+    checkAudioQuality(options.audio_quality)
+    encoder = options.encoder
+    if not encoder:
+        for encoder in ("ffmpeg", "sox", "oggenc"):
+            if distutils.spawn.find_executable(encoder):
+                break
+        else:
+            raise Error("--transcode requires ffmpeg, sox or oggenc on the PATH (or specify --encoder).")
+    if encoder not in encoderCommands:
+        raise Error("Unknown --encoder %s. Must be one of %s." % (encoder, ", ".join(sorted(encoderCommands))))
+    return encoderCommands[encoder]
+    
+    
+def transcodeAudioFiles(projectDir):
+    """Transcode *.wav, *.flac and *.mp3 files in projectDir into *.ogg files (--transcode).
+    
+    Encoded files are cached in .ogg2gme-cache/audio, keyed by the contents of the
+    source file and the encoder settings, so only changed files are re-encoded.
+    *.ogg files which were not generated by this function are never overwritten.
+    """
+    path = lambda fileName: getProjectPath(projectDir, fileName)
+    sources = sorted([os.path.basename(x) for pattern in audioSourcePatterns for x in glob.glob(path(pattern))])
+    cacheDir = path(audioCacheDir)
+    if not sources and not os.path.exists(cacheDir):
+        return
+    mkdir(os.path.dirname(cacheDir))
+    mkdir(cacheDir)
+    index = readIndex(cacheDir)
+    sourceStates = index.setdefault("sources", {})
+    outputs = index.setdefault("outputs", {})
+    encoderCommand = getEncoderCommand()
+    
+    # Get keys of all sources. Only hash sources whose size or mtime changed.
+    oggToKey = {}
+    for source in sources:
+        stat = os.stat(path(source))
+        state = sourceStates.get(source)
+        if not state or state[0] != stat.st_size or state[1] != stat.st_mtime:
+            state = sourceStates[source] = [stat.st_size, stat.st_mtime, hashFile(path(source))]
+        ogg = os.path.splitext(source)[0] + ".ogg"
+        if ogg in oggToKey:
+            raise Error("More than one audio file for %s: %s" % (ogg, ", ".join([x for x in sources if x.startswith(ogg[:-4] + ".")])))
+        if os.path.exists(path(ogg)) and ogg not in outputs:
+            print "Warning: Not transcoding %s, because %s already exists." % (source, ogg)
+            continue
+        oggToKey[ogg] = hashStrings("audio", state[2], encoderCommand, options.audio_quality)
+    
+    # Encode sources which are not yet in the cache in parallel.
+    cmds = []
+    toEncode = set([x for x in oggToKey.values() if not os.path.exists(cacheDir + "/" + x + ".ogg")])
+    for ogg in sorted(oggToKey):
+        key = oggToKey[ogg]
+        if key in toEncode:
+            toEncode.remove(key)
+            source = [x for x in sources if os.path.splitext(x)[0] + ".ogg" == ogg][0]
+            cmds.append(encoderCommand % {"src": path(source), "dst": cacheDir + "/" + key + ".tmp.ogg", "quality": options.audio_quality})
+    if options.verbose and cmds:
+        print "Transcoding %d audio files" % len(cmds)
+    runParallel(cmds)
+    for tmpFileName in glob.glob(cacheDir + "/*.tmp.ogg"):
+        removeFiles(tmpFileName[:-8] + ".ogg")
+        os.rename(tmpFileName, tmpFileName[:-8] + ".ogg")
+        
+    # Update *.ogg files and remove the ones whose source was removed (unless they were modified).
+    for ogg in sorted(set(outputs) - set(oggToKey)):
+        if os.path.exists(path(ogg)) and hashFile(path(ogg)) == outputs[ogg][1]:
+            if options.verbose:
+                print "Removing %s (source removed)" % path(ogg)
+            os.remove(path(ogg))
+            addWrittenFiles([path(ogg)])
+        del outputs[ogg]
+    for ogg in sorted(oggToKey):
+        cacheFileName = cacheDir + "/" + oggToKey[ogg] + ".ogg"
+        if ogg not in outputs or outputs[ogg][0] != oggToKey[ogg] or not os.path.exists(path(ogg)):
+            shutil.copyfile(cacheFileName, path(ogg))
+            addWrittenFiles([path(ogg)])
+            outputs[ogg] = [oggToKey[ogg], hashFile(path(ogg))]
+            
+    # Remove unused files from the cache.
+    for cacheFileName in glob.glob(cacheDir + "/*.ogg"):
+        if os.path.basename(cacheFileName)[:-4] not in oggToKey.values():
+            os.remove(cacheFileName)
+    for source in sourceStates.keys():
+        if source not in sources:
+            del sourceStates[source]
+    writeIndex(cacheDir, index)
+    
+
+def getListOfAudioFiles(projectDir):
+    """Scan projectDir and return sorted list of the paths of its audio (*.ogg) files.
     """
     # Generate stop.ogg if it does not yet exist.
-    if not os.path.exists("STOP.ogg"):
-        shutil.copyfile(dataDir + os.sep + "STOP.ogg", "STOP.ogg")
+    stopFileName = getProjectPath(projectDir, "STOP.ogg")
+    if not os.path.exists(stopFileName):
+        shutil.copyfile(dataDir + os.sep + "STOP.ogg", stopFileName)
+        addWrittenFiles([stopFileName])
     
-    lst = sorted(glob.glob("*.ogg"))
+    lst = sorted(glob.glob(getProjectPath(projectDir, "*.ogg")))
     return lst
     
 
 def appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yamlHead, yamlTail):
     """Append new object codes to yaml file in the script section. (If any.)
+    
+    Return the set of all script names: usedScriptNames and the new ones.
     """
-    audioNames = [os.path.splitext(os.path.basename(x))[0] for x in audioFileList if not x.startswith("_")]
+    audioNames = [os.path.splitext(os.path.basename(x))[0] for x in audioFileList if not os.path.basename(x).startswith("_")]
     
     # Create new scripts for new audio files which play the audio file.
     appendToScripts = []
@@ -228,319 +430,3006 @@ def appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yam
         if options.verbose:
             print "Adding new samples to YAML file %s" % (yamlFileName)
         writeStringToFile(yamlFileName, yamlHead + "".join(appendToScripts) + yamlTail)
+        addWrittenFiles([yamlFileName])
+    return usedScriptNames | set(audioNames)
 
 
-def run(cmd):
-    """Run command.
+# Matches a script which only plays one sample, as generated by appendNewObjectCodesToYaml() or dedupAudio().
+singleSampleScriptRe = re.compile(r"^  ([^:\s]+):\n  - P\(([^)\s]+)\)( # dedup)?\n(?!  - )", re.M)
+
+
+def getAudioHashes(audioFileList, manifest):
+    """Return dict which maps each audio file to the sha1 of its contents.
+    
+    The hashes are cached in manifest["audio"] and only recomputed for files
+    whose size or mtime changed.
+    """
+    cache = manifest.get("audio", {})
+    states = {}
+    for fileName in audioFileList:
+        stat = os.stat(fileName)
+        state = cache.get(fileName)
+        if not state or state[0] != stat.st_size or state[1] != stat.st_mtime:
+            state = [stat.st_size, stat.st_mtime, hashFile(fileName)]
+        states[fileName] = state
+    manifest["audio"] = states
+    return dict([(x, states[x][2]) for x in states])
+
+
+def dedupAudio(yamlFileName, audioFileList, manifest):
+    """Let scripts whose sample has the same contents as another sample play that other sample (--dedup-audio).
+    
+    Only scripts which just play their own sample (as generated) are changed, to
+    '- P(canonical) # dedup', so tttool stores the audio data only once. Scripts
+    whose sample is no longer a duplicate are changed back. Without --dedup-audio
+    all such scripts are changed back. The OIDs of the scripts do not change.
+    """
+    canonical = {}
+    if options.dedup_audio:
+        hashToNames = {}
+        for (fileName, sha1) in getAudioHashes(audioFileList, manifest).items():
+            hashToNames.setdefault(sha1, []).append(os.path.splitext(os.path.basename(fileName))[0])
+        for names in hashToNames.values():
+            # Prefer _welcome etc., which are always stored in the *.gme file.
+            canonicalName = min(names, key=lambda x: (not x.startswith("_"), x))
+            for name in names:
+                canonical[name] = canonicalName
+    
+    audioFiles = set([os.path.basename(x) for x in audioFileList])
+    duplicates = []
+    def replace(match):
+        (name, sample, dedup) = match.groups()
+        if (sample != name and not dedup) or name + ".ogg" not in audioFiles:
+            return match.group(0)
+        sample = canonical.get(name, name)
+        if sample == name:
+            return "  %s:\n  - P(%s)\n" % (name, name)
+        duplicates.append(name)
+        return "  %s:\n  - P(%s) # dedup\n" % (name, sample)
+    s = readStringFromFile(yamlFileName).replace("\r", "")
+    deduped = singleSampleScriptRe.sub(replace, s)
+    if deduped != s:
+        if options.verbose:
+            print "Updating duplicate samples in YAML file %s" % (yamlFileName)
+        writeStringToFile(yamlFileName, deduped)
+        addWrittenFiles([yamlFileName])
+    if duplicates:
+        projectDir = os.path.dirname(yamlFileName)
+        print "%d duplicate samples play an identical sample instead (saves %d bytes)" % (len(duplicates), sum([os.path.getsize(os.path.join(projectDir, x + ".ogg")) for x in duplicates]))
+
+
+def shellCommand(cmd):
+    """Return cmd adapted to the shell of the host operating system.
     """
-    if options.verbose:
-        print "Running " + cmd
     if isWindows():
         cmd = cmd.replace("/", "\\")
         cmd = cmd.replace("'", '"')
     else:
         cmd = cmd.replace(" ( ", " \\( ");
         cmd = cmd.replace(" ) ", " \\) ");
-    if os.system(cmd):
-        raise Error("Command failed: " + cmd)
+    return cmd
 
-    
-def buildGme(yamlFileName, tttool):
-    """Invoke tttool and build GME file.
+
+class BuildState(threading.local):
+    """Phase times and --profile records of the build which runs in the current thread.
     """
-    run(tttool + " assemble " + yamlFileName)
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        """Forget the last build.
+        """
+        # Start time of the build.
+        self.startTime = time.time()
+        # Wall time in seconds of each phase. See Phase.
+        self.phaseTimes = {}
+        # With --profile: Records of all phases, commands and tasks.
+        self.profile = []
+        # Number of processes started (commands and worker processes).
+        self.numForks = 0
+        # Name of the innermost phase which is currently running.
+        self.currentPhase = ""
+        # States (see getFileStates) of the project files which the build wrote (None: removed). See addWrittenFiles.
+        self.writtenFiles = {}
 
-    
-def getHighestNamedOid(codesYamlFileName):
-    """Read foo.codes.yaml file and detremine highest used code.
+
+buildState = BuildState()
+
+
+class BuildOptions(threading.local):
+    """Options (see BuildConfig) of the build which runs in the current thread. See useConfig().
     """
-    lines = readStringFromFile(codesYamlFileName).splitlines()
-    lines = [x for x in lines if x.startswith("  ")]
-    max = 0
-    for line in lines:
-        fields = line.split(":")
-        if len(fields) < 2:
-            continue
-        oid = int(fields[1])
-        if oid > max:
-            max = oid
-    if options.verbose:
-        print "Highest used code: %d" % max
-    return max
+    pass
     
     
-def generateAdditionalOids(numNamedOids, totalOids, codesYamlFileName, dstdir, tttool):
-    """Generate additional oids, beyond the ones which are generated by the YAML file.
-    For future extension without re-printing oids.
-    """
-    if totalOids <= numNamedOids:
-        return
-    highestNamedOid = getHighestNamedOid(codesYamlFileName)
-    start = highestNamedOid + 1
-    num = totalOids - numNamedOids
-    end = start + num - 1
-    if options.verbose:
-        print "Generating %d additional ext_* oids into %s" % (num, dstdir)
-    run(tttool + " oid-code -d " + options.dpi + " %d-%d" % (start, end))
+options = BuildOptions()
 
-    
-def removeFiles(pattern):
-    """Remove files matching glob pattern.
+
+def addWrittenFiles(fileNames):
+    """Record the states of files which the current build just wrote or removed, so --watch does not rebuild because of them.
     """
-    for f in glob.glob(pattern):
-        os.remove(f)
-    
+    for fileName in fileNames:
+        buildState.writtenFiles[os.path.normpath(fileName)] = getFileStates([fileName]).get(fileName)
         
-def mkdir(path):
-    """Make directory if it does not yet exist.
+        
+def getUsage():
+    """Return (cpuSeconds, bytesWritten) of this process and all its terminated children so far.
+    
+    Either value is None if the host operating system does not provide it.
+    Note: The values include builds which run concurrently in other threads.
     """
-    if os.path.isdir(path):
-        return
-    os.mkdir(path)
+    cpu = None
+    if resource:
+        cpu = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            cpu += usage.ru_utime + usage.ru_stime
+    written = None
+    if os.path.exists("/proc/self/io"):
+        for line in readStringFromFile("/proc/self/io").splitlines():
+            if line.startswith("wchar:"):
+                written = int(line.split()[1])
+    return (cpu, written)
 
-    
-def rmdir(path):
-    """Try to remove empty directory. Do nothing if the directory is not empty or does not exist.
+
+def startRecord(category, name):
+    """Return new profile record for a phase, command or task which starts now.
     """
-    try:
-        os.rmdir(path)
-    except:
-        pass
+    return {"category": category, "name": name, "phase": buildState.currentPhase, "pid": os.getpid(), "start": time.time(), "usage": getUsage()}
+
+
+def finishRecord(record, status, forks):
+    """Fill in wall and CPU time, bytes written, exit status and number of forks of record and return it.
+    """
+    (cpu, written) = getUsage()
+    (startCpu, startWritten) = record.pop("usage")
+    record["wall"] = time.time() - record["start"]
+    record["cpu"] = cpu - startCpu if cpu is not None else None
+    record["written"] = written - startWritten if written is not None else None
+    record["status"] = status
+    record["forks"] = forks
+    return record
+
+
+def addRecord(record, phase=None):
+    """Add record of a command or task (possibly run by a worker process) to profile.
     
+    The record belongs to phase, by default to the current phase.
+    """
+    if record:
+        buildState.numForks += record["forks"]
+        record["phase"] = phase or buildState.currentPhase
+        buildState.profile.append(record)
+
+
+class Phase:
+    """Context manager which adds the wall time of a block to buildState.phaseTimes[name].
     
-def refParentDirIfNecessary(path):
-    """Return ../path if path starts with a dot, else return path.    
+    With --profile the phase is also recorded in buildState.profile. A block which
+    does the work of several phases concurrently (see the chains of runTask()) fills
+    the dict shares with the seconds spent on each of them. Its wall time is then
+    split among these phases in proportion.
     """
-    if path.startswith("."):
-        return "../" + path
-    else:
-        return path
+    def __init__(self, name, shares=None):
+        self.name = name
+        self.shares = shares
+        
+    def __enter__(self):
+        self.outerPhase = buildState.currentPhase
+        self.startForks = buildState.numForks
+        self.record = startRecord("phase", self.name)
+        self.startTime = time.time()
+        buildState.currentPhase = self.name
+        
+    def __exit__(self, excType, excValue, traceback):
+        buildState.currentPhase = self.outerPhase
+        wall = time.time() - self.startTime
+        shares = dict([x for x in (self.shares or {}).items() if x[1] > 0]) or {self.name: 1.0}
+        total = sum(shares.values())
+        phaseTimes = buildState.phaseTimes
+        if options.profile:
+            record = finishRecord(self.record, 0 if excType is None else 1, buildState.numForks - self.startForks)
+        for (name, seconds) in sorted(shares.items()):
+            share = seconds / total
+            phaseTimes[name] = phaseTimes.get(name, 0.0) + wall * share
+            if options.profile:
+                scale = lambda x: x * share if x is not None else None
+                buildState.profile.append(dict(record, name=name, wall=record["wall"] * share, cpu=scale(record["cpu"]), 
+                                               written=scale(record["written"]), forks=int(round(record["forks"] * share))))
+        
         
+class Scheduler:
+    """Run the steps of a build as soon as the steps they depend on are done (a small DAG scheduler).
     
-def buildOidTable(yamlFileName, codesYamlFileName, productId, tttool):
-    """Generate oid-table PNG.
+    Independent steps run concurrently in threads, with the options of the
+    calling thread. Their phase times, --profile records and written files are
+    added to the buildState of the calling thread. With --jobs 1 the steps run one after the
+    other in the calling thread.
     """
-    columns = options.num_columns
-    minAdditionalOids = options.num_additional_oids
-    oid_orig_dir = "oid_orig"
-    oid_box_dir = "oid_box"
-    oid_label_dir = "oid_label"
-    powerOnFile = dataDir + "/power_on.gif" # Size does not matter. Should be around 376x376.
-    stopSymbolFile = dataDir + "/stop_gelb.gif" # Size does not matter. Should be around 376x376.
-    
-    # Tmm: All lengths in 1/10 mm.
-    
-    # Page layout.
-    columnWidth = 1900 / columns
-    pageHeight = 2800
-    textSep = 10
-    lineSep = 10
-    textPointSize = 72
-    dpi = 600.0
-    if options.dpi.startswith("1200"):
-        dpi *= 2
-        textPointSize *= 2
-    toPixel = lambda x : int(x * dpi / 25.4 / 10.0)
-    columnWidthPixel = toPixel(columnWidth)
-    pageHeightPixel = toPixel(pageHeight)
-    textSepPixel = toPixel(textSep)
-    lineSepPixel = toPixel(lineSep)
-
-    # Get --shape "box" parameters. Parse --shape=box:WIDTH:HEIGHT:BORDER_WIDTH:BORDER_COLOR spec.
-    # Defaults:
-    boxTotalWidthTmm = 160
-    boxTotalHeightTmm = 160
-    boxBorderWidthTmm = 10
-    boxBorderColor = "red"
-    if options.shape.startswith("box:"):
-        fields = options.shape.split(":")
-        if len(fields) >= 2:
-            boxTotalWidthTmm = castTo(fields[1], int, 1)
-            boxTotalHeightTmm = boxTotalWidthTmm
-        if len(fields) >= 3:
-            boxTotalHeightTmm = castTo(fields[2], int, 1)
-        if len(fields) >= 4:
-            boxBorderWidthTmm = castTo(fields[3], int, 1)
-        if len(fields) >= 5:
-            boxBorderColor = fields[4]            
-    boxInnerWidthPixel = toPixel(boxTotalWidthTmm - 2 * boxBorderWidthTmm)
-    boxInnerHeightPixel = toPixel(boxTotalHeightTmm - 2 * boxBorderWidthTmm)
-    boxBorderWidthPixel = toPixel(boxBorderWidthTmm)
-    boxTotalWidthPixel = boxInnerWidthPixel + 2 * boxBorderWidthPixel
-    boxTotalHeightPixel = boxInnerHeightPixel + 2 * boxBorderWidthPixel
-    
-    # Get number of oids per page. This depends on the box height.
-    labelTotalHeightPixel = boxTotalHeightPixel + 2 * (lineSepPixel / 2)
-    numRows = pageHeightPixel / labelTotalHeightPixel
-    numOidsPerPage = numRows * columns
+    def __init__(self):
+        self.steps = []
+        
+    def add(self, name, function, dependencies=[]):
+        """Add step name which calls function() after all steps in dependencies are done.
+        """
+        self.steps.append((name, function, dependencies))
+        
+    def runStep(self, name, function, parentOptions, parentStartTime, finished):
+        """Thread: Run one step and put (name, excInfo, buildState of the step) into the queue finished.
+        """
+        options.__dict__.update(parentOptions)
+        buildState.startTime = parentStartTime
+        excInfo = None
+        try:
+            function()
+        except:
+            excInfo = sys.exc_info()
+        finished.put((name, excInfo, (buildState.phaseTimes, buildState.profile, buildState.numForks, buildState.writtenFiles)))
+        
+    def run(self):
+        """Run all steps. Raise the error of the first failing step after all running steps finished.
+        
+        No further steps are started once a step failed.
+        """
+        if options.jobs <= 1:
+            done = set()
+            while len(done) < len(self.steps):
+                for (name, function, dependencies) in self.steps:
+                    if name not in done and done.issuperset(dependencies):
+                        function()
+                        done.add(name)
+            return
+        finished = Queue.Queue()
+        pending = list(self.steps)
+        done = set()
+        running = 0
+        excInfo = None
+        while True:
+            for step in [x for x in pending if done.issuperset(x[2])]:
+                pending.remove(step)
+                if not excInfo:
+                    thread = threading.Thread(target=self.runStep, args=step[:2] + (dict(options.__dict__), buildState.startTime, finished))
+                    thread.daemon = True
+                    thread.start()
+                    running += 1
+            if not running:
+                break
+            # Waiting with a timeout keeps Ctrl-C working in Python 2.
+            (name, stepExcInfo, (phaseTimes, profile, numForks, writtenFiles)) = finished.get(True, 999999)
+            running -= 1
+            done.add(name)
+            for (phase, seconds) in phaseTimes.items():
+                buildState.phaseTimes[phase] = buildState.phaseTimes.get(phase, 0.0) + seconds
+            buildState.profile += profile
+            buildState.numForks += numForks
+            buildState.writtenFiles.update(writtenFiles)
+            excInfo = excInfo or stepExcInfo
+        if excInfo:
+            raise excInfo[0], excInfo[1], excInfo[2]
+        
+        
+def runCommand(cmd, cwd=None, profile=False):
+    """Run shell command in directory cwd (default: the current directory).
     
-    # Create and clear output directories.
-    mkdir(oid_orig_dir)
-    mkdir(oid_box_dir)
-    mkdir(oid_label_dir)  # Automatically removed at the end of this function.
-    removeFiles(oid_orig_dir + "/oid-*.png")
-    removeFiles(oid_box_dir + "/box_oid-*.png")
-    removeFiles(oid_label_dir + "/label_oid-*.png")
+    Return (exitStatus, record). record is None unless profile (--profile) is True.
+    """
+    record = startRecord("command", cmd) if profile else None
+    status = subprocess.call(shellCommand(cmd), shell=True, cwd=cwd)
+    if record:
+        finishRecord(record, status, 1)
+    return (status, record)
 
-    # Generate oids from the *.yaml file into oid_orig_dir.
+        
+def run(cmd, cwd=None):
+    """Run command in directory cwd (default: the current directory).
+    """
     if options.verbose:
-        print "Generating oids into %s" % oid_orig_dir
-    os.chdir(oid_orig_dir)
-    try:
-        run(refParentDirIfNecessary(tttool) + " oid-code -d " + options.dpi + " ../" + yamlFileName)
-    finally:
-        os.chdir("..")
+        print "Running " + cmd
+    (status, record) = runCommand(cmd, cwd, options.profile)
+    addRecord(record)
+    if status:
+        raise Error("Command failed: " + cmd)
+
+
+def runTask(taskAndProfile):
+    """Worker function for runParallel(): Run one task and return (errorMessage, records, phaseSeconds).
     
-    # Generate additional oids into oid_orig_dir.
-    os.chdir(oid_orig_dir)
+    taskAndProfile is a (task, profile) tuple. A task is either a shell command
+    string, a (description, function, args) tuple or a chain: a list of (phase,
+    command) tuples whose commands run one after the other until one fails.
+    errorMessage is None on success. records is the list of (phase, record) of the
+    profile records if profile (--profile) is True; phase None is the current phase.
+    phaseSeconds maps the phases of a chain to the wall time of their commands.
+    A function may return such a dict, too.
+    Worker processes do not inherit the options of the build (e.g. on Windows),
+    so tasks must not read options; all they need is passed in their args.
+    """
+    (task, profile) = taskAndProfile
+    if isinstance(task, basestring):
+        (status, record) = runCommand(task, None, profile)
+        return ("Command failed: " + task if status else None, [(None, record)] if record else [], {})
+    if isinstance(task, list):
+        (records, phaseSeconds) = ([], {})
+        for (phase, cmd) in task:
+            startTime = time.time()
+            (status, record) = runCommand(cmd, None, profile)
+            phaseSeconds[phase] = phaseSeconds.get(phase, 0.0) + time.time() - startTime
+            if record:
+                records.append((phase, record))
+            if status:
+                return ("Command failed: " + cmd, records, phaseSeconds)
+        return (None, records, phaseSeconds)
+    (description, function, args) = task
+    record = startRecord("task", description) if profile else None
+    (message, phaseSeconds) = (None, None)
     try:
-        numNamedOids = len(glob.glob("oid-*.png")) + (options.num_start_oid - 1) + (options.num_start_oid - 1)
-        totalOids = numOidsPerPage
-        while numNamedOids + minAdditionalOids > totalOids:
-            totalOids += numOidsPerPage
-        generateAdditionalOids(numNamedOids, totalOids, "../" + codesYamlFileName, oid_orig_dir, refParentDirIfNecessary(tttool))
-    finally:
-        os.chdir("..")
+        phaseSeconds = function(*args)
+    except Exception as e:
+        message = "%s failed: %s" % (description, e)
+    if record:
+        finishRecord(record, 1 if message else 0, 0)
+    return (message, [(None, record)] if record else [], phaseSeconds or {})
+
+
+def describeTask(task):
+    """Return the text echoed for task in verbose mode.
+    """
+    if isinstance(task, basestring):
+        return "Running " + task
+    if isinstance(task, list):
+        return "Running " + " && ".join([x[1] for x in task])
+    return task[0]
+
 
-    # Get list of orioginal OID files.
-    os.chdir(oid_orig_dir)
+def runParallel(tasks):
+    """Run a list of independent tasks (see runTask()) on a pool of --jobs worker processes.
+    
+    Tasks are started and echoed in list order. When a task fails no further
+    tasks are started and Error is raised for the first failing task.
+    Return dict which maps phases to the seconds spent on them by the tasks (see
+    runTask()), e.g. for the shares of Phase.
+    """
+    phaseSeconds = {}
+    def addResult(result):
+        (message, records, taskPhaseSeconds) = result
+        for (phase, record) in records:
+            addRecord(record, phase)
+        for (phase, seconds) in taskPhaseSeconds.items():
+            phaseSeconds[phase] = phaseSeconds.get(phase, 0.0) + seconds
+        if message:
+            raise Error(message)
+    if options.jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            if options.verbose:
+                print describeTask(task)
+            addResult(runTask((task, options.profile)))
+        return phaseSeconds
+    # ImageMagick is multi-threaded itself. Do not oversubscribe the cores.
+    os.environ.setdefault("MAGICK_THREAD_LIMIT", "1")
+    buildState.numForks += min(options.jobs, len(tasks))
+    pool = multiprocessing.Pool(min(options.jobs, len(tasks)))
     try:
-        origOidFiles = sorted(glob.glob("oid-*.png"))
+        results = pool.imap(runTask, [(x, options.profile) for x in tasks])
+        for task in tasks:
+            if options.verbose:
+                print describeTask(task)
+            # Waiting with a timeout keeps Ctrl-C working in Python 2.
+            addResult(results.next(999999))
+        pool.close()
     finally:
-        os.chdir("..")
-        
-    # Split into startOidFiles, namedOidFiles and numberedOidFiles and generate label names.
-    startOidFiles = []
-    stopOidFiles = []
-    namedOidFiles = []
-    numberedOidFiles = []
-    oidFileNameToName = {}
-    for fileName in origOidFiles:
-        if re.search("^oid-[0-9]+-START.png$", fileName):
-            startOidFiles.append(fileName)
-            oidFileNameToName[fileName] = "START"
-        elif re.search("^oid-[0-9]+-STOP.png$", fileName):
-            stopOidFiles.append(fileName)
-            oidFileNameToName[fileName] = "STOP"
-        else:
-            match = re.search("^oid-([0-9]+).png$", fileName)
-            if match:
-                numberedOidFiles.append(fileName)
-                oidFileNameToName[fileName] = "ext_" + match.group(1)
-            else:
-                match = re.search("^oid-[0-9]+-(.+).png$", fileName)
-                if match:
-                    namedOidFiles.append(fileName)    
-                    oidFileNameToName[fileName] = match.group(1)
-                else:
-                    print "Ignoring PNG %s" % fileName
+        pool.terminate()
+        pool.join()
+    return phaseSeconds
 
-    # Generate boxes or shapes.
-    resize_op = "-sample" # -sample duplicates/deletes whole rows/columns and does not add new colors. This is desirable as we want to keep the output images with a low number of colors to prevent Word from re-dithering them.
-    for origOidFile in origOidFiles:
-        origOidFileName = oid_orig_dir + "/" + origOidFile
-        boxOidFileName = oid_box_dir + "/box_" + origOidFile
-        if re.search("^oid-[0-9]+-START.png$", origOidFile):
-            # Green power-on symbol.
-            run("convert ( -page +0+0 %s %s %dx%d -page +0+0 %s -flatten ) ( %s %s %dx%d -alpha extract ) -alpha Off -compose CopyOpacity -composite %s" % \
-            (powerOnFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, origOidFileName, powerOnFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, boxOidFileName))
-        elif re.search("^oid-[0-9]+-STOP.png$", origOidFile):
-            # Stop symbol.
-            run("convert ( -page +0+0 %s %s %dx%d -page +0+0 %s -flatten ) ( %s %s %dx%d -alpha extract ) -alpha Off -compose CopyOpacity -composite %s" % \
-            (stopSymbolFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, origOidFileName, stopSymbolFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, boxOidFileName))
-        elif options.shape.startswith("box:") or options.shape == "box":
-            # Red box or custom box.            
-            run("convert %s ( -crop %dx%d+0+0 +repage -density 600x600 ) -bordercolor %s -compose Copy -border %d %s" % \
-            (origOidFileName, boxInnerWidthPixel, boxInnerHeightPixel, boxBorderColor, boxBorderWidthPixel, boxOidFileName))
-        else:
-            # Shape file in "data" dir.
-            shapeFile = dataDir + "/" + options.shape
-            run("convert ( -page +0+0 %s %s %dx%d -page +0+0 %s -flatten ) ( %s %s %dx%d -alpha extract ) -alpha Off -compose CopyOpacity -composite %s" % \
-            (shapeFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, origOidFileName, shapeFile, resize_op, boxTotalWidthPixel, boxTotalHeightPixel, boxOidFileName))
-                    
 
-    # Generate labels.
-    for origOidFile in origOidFiles:
-        name = oidFileNameToName[origOidFile]
-        boxOidFileName = oid_box_dir + "/box_" + origOidFile
-        labelOidFileName = oid_label_dir + "/label_" + origOidFile
-        run("convert %s ( -extent %dx%d ) ( -gravity West -stroke none -pointsize %d -annotate +%d+0 %s ) -bordercolor white -compose Copy -border %d %s" % \
-        (boxOidFileName, columnWidthPixel, boxTotalHeightPixel, textPointSize, boxTotalWidthPixel + textSepPixel, name, lineSepPixel / 2, labelOidFileName))
-            
-            
-    # Generate label pages.
-    # Generate start/stop labels N times:
-    allLabels = (startOidFiles * options.num_start_oid) + (stopOidFiles * options.num_start_oid)
-    if options.num_normal_oid > 1:
-        allLabels += sorted((namedOidFiles * options.num_normal_oid) + (numberedOidFiles * options.num_normal_oid))
-    else:
-        allLabels += namedOidFiles + numberedOidFiles
-    allLabels = [oid_label_dir + "/label_" + x for x in allLabels]
-    for i in range(0, len(allLabels), numOidsPerPage):
-        run("montage -border 20 %s -mode Concatenate -tile %dx _oid-table%d.png" % (" ".join(allLabels[i:i + numOidsPerPage]), columns, i / numOidsPerPage))
 
-    removeFiles(oid_label_dir + "/label_oid-*.png")
-    rmdir(oid_label_dir)
+def formatBytes(n):
+    """Return number of bytes n as short string (e.g. 12.3M), or '-' for None.
+    """
+    if n is None:
+        return "-"
+    if n < 1024:
+        return "%d" % n
+    for unit in "KMG":
+        n /= 1024.0
+        if n < 1024 or unit == "G":
+            return "%.1f%s" % (n, unit)
 
 
-def main():
-    global options
-    usage = """Usage: %prog [options]
+def formatSeconds(seconds):
+    """Return seconds as string, or '-' for None.
+    """
+    if seconds is None:
+        return "-"
+    return "%.2fs" % seconds
 
-Convert all *.ogg files found in the current directory into a Tip-Toi *.gme file and
-optionally (-t) a _oid-table0.png file which contains the OID labels.
 
-This tool is useful when generating simple OID labels, each associated with one sample.
-Examples: 
-    - Adding Tip-Toi support to non-Tip-Toi books.
-    - Audio CDs.
+def sumValues(values):
+    """Return sum of values or None if any value is None.
+    """
+    if None in values:
+        return None
+    return sum(values)
 
-The generated *.yaml file can be edited at any time and is not overwritten by this tool.
-This tool always adds samples to the *.yaml file which are not yet in the *.yaml file.
 
-This tool requires:
-    - tttool (must be in ../tttool)
-    - convert/montage (from ImageMagick, must be on the PATH)
-"""
-    parser = optparse.OptionParser(usage=usage, version=version)
-    parser.add_option("-t", "--build-oid-table",  default=False, action="store_true", help="Generate PNG file(s) which contain(s) all oids for this product.")
-    parser.add_option("-S", "--num-start-oid",  default=3, type="int", help="For -t/--build-oid-table: Generate N START and N STOP OIDs (e.g. to re-use the same product id for multiple projects). Default is 3.")
+def getCommandGroup(record):
+    """Return the group of a command or task record in the --profile summary, e.g. 'boxes: convert'.
+    """
+    words = record["name"].split()
+    group = os.path.basename(words[0])
+    if group.startswith("tttool") and len(words) > 1:
+        group += " " + words[1]
+    return "%s: %s" % (record["phase"] or "-", group)
+
+
+def printProfile():
+    """Print summary of the profile records of the last build in this thread (--profile).
+    """
+    seconds = time.time() - buildState.startTime
+    profile = buildState.profile
+    print
+    print "%-24s %6s %9s %9s %9s %6s" % ("Phase", "Count", "Wall", "CPU", "Written", "Forks")
+    phases = [x for x in profile if x["category"] == "phase"]
+    for name in sorted(set([x["name"] for x in phases]), key=lambda x: min([y["start"] for y in phases if y["name"] == x])):
+        records = [x for x in phases if x["name"] == name]
+        print "%-24s %6d %9s %9s %9s %6d" % (name, len(records), formatSeconds(sum([x["wall"] for x in records])),
+            formatSeconds(sumValues([x["cpu"] for x in records])), formatBytes(sumValues([x["written"] for x in records])), sum([x["forks"] for x in records]))
+    print "%-24s %6s %9s" % ("total", "", formatSeconds(seconds))
+    
+    commands = [x for x in profile if x["category"] != "phase"]
+    if not commands:
+        return
+    print
+    print "%-32s %6s %9s %9s %9s %9s %9s %6s" % ("Commands", "Count", "Wall", "Mean", "Max", "CPU", "Written", "Failed")
+    groups = {}
+    for record in commands:
+        groups.setdefault(getCommandGroup(record), []).append(record)
+    for group in sorted(groups, key=lambda x: groups[x][0]["start"]):
+        records = groups[group]
+        wall = sum([x["wall"] for x in records])
+        print "%-32s %6d %9s %9s %9s %9s %9s %6d" % (group, len(records), formatSeconds(wall), formatSeconds(wall / len(records)),
+            formatSeconds(max([x["wall"] for x in records])), formatSeconds(sumValues([x["cpu"] for x in records])),
+            formatBytes(sumValues([x["written"] for x in records])), len([x for x in records if x["status"]]))
+    print
+    print "Slowest commands:"
+    for record in sorted(commands, key=lambda x: -x["wall"])[:5]:
+        name = record["name"] if len(record["name"]) <= 100 else record["name"][:97] + "..."
+        print "%9s  %s" % (formatSeconds(record["wall"]), name)
+    failed = [x for x in commands if x["status"]]
+    if failed:
+        print
+        print "Failed commands:"
+        for record in failed:
+            print "%9s  %s" % ("status %d" % record["status"], record["name"])
+        
+
+def writeTrace(fileName):
+    """Write the profile records of the last build in this thread as Chrome trace event JSON file (--trace).
+    
+    The file can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+    profile = buildState.profile
+    if not profile:
+        return
+    startTime = min([x["start"] for x in profile])
+    mainPid = os.getpid()
+    events = []
+    for record in profile:
+        events.append({"name": record["name"], "cat": record["category"], "ph": "X",
+                       "ts": int((record["start"] - startTime) * 1e6), "dur": int(record["wall"] * 1e6),
+                       "pid": mainPid, "tid": record["pid"],
+                       "args": {"phase": record["phase"], "cpu": record["cpu"], "written": record["written"],
+                                "status": record["status"], "forks": record["forks"]}})
+    writeStringToFile(fileName, json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+    if options.verbose:
+        print "Wrote trace to " + fileName
+
+
+    
+def buildGme(yamlFileName, tttool, gmeFileName=""):
+    """Invoke tttool and build GME file (by default next to the *.yaml file).
+    """
+    run(tttool + " assemble " + os.path.basename(yamlFileName) + (" " + os.path.abspath(gmeFileName) if gmeFileName else ""), os.path.dirname(yamlFileName) or None)
+    addWrittenFiles([yamlFileName[:-5] + ".codes.yaml"])
+
+
+# Offsets of the pointers in the header of *.gme files (see the GME file format documentation of tttool).
+# A *.gme file is only patched if all of them point in front of the audio data.
+gmeHeaderPointers = [0x00, 0x04, 0x0C, 0x10, 0x18, 0x60, 0x71, 0x8C, 0x90, 0x94, 0x98, 0x9C, 0xA0]
+
+
+def getXorTable(key):
+    """Return translation table which scrambles (and unscrambles) the audio data in *.gme files with key.
+    
+    The bytes 0x00, 0xff, key and key ^ 0xff are stored unchanged.
+    """
+    return "".join([chr(x if x in (0, 0xff, key, key ^ 0xff) else x ^ key) for x in range(256)])
+    
+    
+def readGmeMedia(data):
+    """Parse the media tables of the contents of a *.gme file (string or mmap).
+    
+    Return (tableOffsets, entries, key): The offsets of the media table and of the
+    additional media table (which must be equal), the list of (offset, length) of
+    the audio files and the XOR key. Return None if the layout is not the one
+    written by tttool assemble: The audio files must be stored back to back
+    behind all other data (except the checksum), in the order of the table.
+    """
+    u32 = lambda offset: struct.unpack("<I", data[offset:offset + 4])[0]
+    if len(data) < 0x200 or u32(0x08) != 0x238b:
+        return None
+    tableOffsets = [u32(0x04)] + [x for x in [u32(0x60)] if x and x != u32(0x04)]
+    tableOffset = tableOffsets[0]
+    if tableOffset + 8 > len(data):
+        return None
+    numEntries = (u32(tableOffset) - tableOffset) / 8
+    if numEntries <= 0 or tableOffset + 8 * numEntries > len(data):
+        return None
+    entries = list(struct.unpack("<%dI" % (2 * numEntries), data[tableOffset:tableOffset + 8 * numEntries]))
+    entries = zip(entries[0::2], entries[1::2])
+    for offset in tableOffsets[1:]:
+        if offset + 8 * numEntries > len(data) or data[offset:offset + 8 * numEntries] != data[tableOffset:tableOffset + 8 * numEntries]:
+            return None
+    # Identical audio files may share their data.
+    regions = sorted(set(entries))
+    end = regions[0][0]
+    for (offset, length) in regions:
+        if offset != end:
+            return None
+        end += length
+    if end > len(data) - 4 or any([u32(x) >= regions[0][0] for x in gmeHeaderPointers]):
+        return None
+    # The key turns the first audio file into an Ogg (or Wave) file.
+    for key in range(256):
+        if data[regions[0][0]:regions[0][0] + 4].translate(getXorTable(key)) in ("OggS", "RIFF"):
+            return (tableOffsets, entries, key)
+    return None
+    
+    
+def getGmeMediaFiles(gmeFileName, audioHashes):
+    """Return the audio files in the media table of a *.gme file built by tttool assemble.
+    
+    audioHashes are the hashes of the audio files (see getAudioHashes()) as
+    tttool read them. Each entry is the sorted list of the base names of all
+    audio files with the contents of the entry (usually one). Return None if
+    the *.gme file cannot be patched (see readGmeMedia()) or contains audio
+    data which is not one of the files in audioHashes.
+    """
+    hashToNames = {}
+    for (fileName, sha1) in sorted(audioHashes.items()):
+        hashToNames.setdefault(sha1, []).append(os.path.basename(fileName))
+    f = open(gmeFileName, "rb")
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            media = readGmeMedia(data)
+            if not media:
+                return None
+            (tableOffsets, entries, key) = media
+            xorTable = getXorTable(key)
+            names = [hashToNames.get(hashlib.sha1(data[offset:offset + length].translate(xorTable)).hexdigest()) for (offset, length) in entries]
+        finally:
+            data.close()
+    finally:
+        f.close()
+    return names if None not in names else None
+    
+    
+def patchGme(gmeFileName, mediaFiles, changedFiles):
+    """Replace the changed audio files in a *.gme file instead of running tttool assemble. Return True on success.
+    
+    mediaFiles are the audio files of the media table (see getGmeMediaFiles()).
+    Return False (and leave the *.gme file unchanged) if the *.gme file cannot be
+    patched, e.g. when a changed file had the same contents as another file, so
+    it is unknown which entry is the changed one. Audio files of the same size are overwritten in place, otherwise
+    the *.gme file is rewritten with the following audio files moved. The
+    checksum is the sum of all bytes, so it is updated by the difference.
+    """
+    changedFiles = set([os.path.basename(x) for x in changedFiles])
+    f = open(gmeFileName, "r+b")
+    try:
+        data = mmap.mmap(f.fileno(), 0)
+        try:
+            media = readGmeMedia(data)
+            if not media or len(media[1]) != len(mediaFiles):
+                return False
+            (tableOffsets, entries, key) = media
+            xorTable = getXorTable(key)
+            newData = {}
+            for (region, fileNames) in zip(entries, mediaFiles):
+                if changedFiles.intersection([os.path.basename(x) for x in fileNames]):
+                    if len(fileNames) > 1:
+                        return False
+                    newData[region] = readStringFromFile(fileNames[0]).translate(xorTable)
+            if options.verbose:
+                print "Patching %d audio files in %s" % (len(newData), gmeFileName)
+            checksumOffset = len(data) - 4
+            checksum = struct.unpack("<I", data[checksumOffset:])[0]
+            for (region, payload) in newData.items():
+                checksum += sum(bytearray(payload)) - sum(bytearray(data[region[0]:region[0] + region[1]]))
+            
+            if all([len(payload) == region[1] for (region, payload) in newData.items()]):
+                for (region, payload) in newData.items():
+                    data[region[0]:region[0] + region[1]] = payload
+                data[checksumOffset:] = struct.pack("<I", checksum & 0xffffffff)
+                data.flush()
+                return True
+            
+            # Move the audio files behind changed files with a different size and write a new *.gme file.
+            regions = sorted(set(entries))
+            newOffsets = {}
+            offset = regions[0][0]
+            for region in regions:
+                newOffsets[region] = offset
+                offset += len(newData[region]) if region in newData else region[1]
+            head = bytearray(data[:regions[0][0]])
+            checksum -= sum(head)
+            for tableOffset in tableOffsets:
+                for (i, region) in enumerate(entries):
+                    head[tableOffset + 8 * i:tableOffset + 8 * i + 8] = struct.pack("<II", newOffsets[region], len(newData[region]) if region in newData else region[1])
+            checksum += sum(head)
+            tmpFileName = gmeFileName + ".tmp"
+            out = open(tmpFileName, "wb")
+            out.write(head)
+            for region in regions:
+                out.write(newData[region] if region in newData else data[region[0]:region[0] + region[1]])
+            end = regions[-1][0] + regions[-1][1]
+            out.write(data[end:checksumOffset])
+            out.write(struct.pack("<I", checksum & 0xffffffff))
+            out.close()
+        finally:
+            data.close()
+    finally:
+        f.close()
+    if isWindows():
+        os.remove(gmeFileName)
+    os.rename(tmpFileName, gmeFileName)
+    return True
+    
+    
+def verifyGme(yamlFileName, gmeFileName, tttool):
+    """Compare patched *.gme file with the output of tttool assemble (--verify-patch).
+    
+    On a difference the *.gme file is replaced by the output of tttool assemble and Error is raised.
+    """
+    assembledFileName = gmeFileName + ".verify.gme"
+    with Phase("verify"):
+        buildGme(yamlFileName, tttool, assembledFileName)
+        difference = compareGme(gmeFileName, assembledFileName)
+    if difference:
+        os.remove(gmeFileName)
+        os.rename(assembledFileName, gmeFileName)
+        raise Error("Patched %s differs from the output of tttool assemble (%s). Using the output of tttool assemble." % (gmeFileName, difference))
+    os.remove(assembledFileName)
+    if options.verbose:
+        print "Patched %s matches the output of tttool assemble" % gmeFileName
+    
+    
+def compareGme(gmeFileName, otherGmeFileName):
+    """Return None if two *.gme files contain the same scripts and audio data, else a description of the difference.
+    
+    The headers (which contain the date of the build) are not compared.
+    """
+    (a, b) = (readStringFromFile(gmeFileName), readStringFromFile(otherGmeFileName))
+    (mediaA, mediaB) = (readGmeMedia(a), readGmeMedia(b))
+    if not mediaA or not mediaB:
+        return "unknown layout"
+    if mediaA[1] != mediaB[1]:
+        return "different media tables"
+    (start, end) = (struct.unpack("<I", a[:4])[0], min(mediaA[1])[0])
+    if a[start:end] != b[start:end]:
+        return "different scripts"
+    for (offset, length) in mediaA[1]:
+        if a[offset:offset + length].translate(getXorTable(mediaA[2])) != b[offset:offset + length].translate(getXorTable(mediaB[2])):
+            return "different audio data at offset %d" % offset
+    for data in (a, b):
+        if sum(bytearray(data[:-4])) & 0xffffffff != struct.unpack("<I", data[-4:])[0]:
+            return "wrong checksum"
+    return None
+    
+
+
+def getManifestFileName(yamlFileName):
+    """Return name of the build manifest which is kept next to the *.gme file.
+    """
+    return yamlFileName[:-5] + ".gme.manifest"
+    
+    
+def decodeJson(text):
+    """Parse JSON text like json.loads(), but return all strings as UTF-8 str, like the (file) names of the build.
+    """
+    def encode(value):
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        if isinstance(value, list):
+            return [encode(x) for x in value]
+        if isinstance(value, dict):
+            return dict([(encode(x), encode(y)) for (x, y) in value.items()])
+        return value
+    return encode(json.loads(text))
+    
+    
+def mapManifestPaths(manifest, function):
+    """Return copy of manifest with function applied to all file names (of the file states, audio hashes and OID table pages).
+    """
+    manifest = dict(manifest)
+    if "gme" in manifest:
+        manifest["gme"] = dict(manifest["gme"], files=dict([(function(x), y) for (x, y) in manifest["gme"].get("files", {}).items()]))
+    if "audio" in manifest:
+        manifest["audio"] = dict([(function(x), y) for (x, y) in manifest["audio"].items()])
+    if "oid-table" in manifest:
+        manifest["oid-table"] = dict(manifest["oid-table"], pages=[function(x) for x in manifest["oid-table"].get("pages", [])])
+    return manifest
+    
+    
+def readManifest(manifestFileName):
+    """Read build manifest. Return an empty manifest if there is no valid manifest.
+    
+    The manifest records the state of all inputs of the last successful *.gme and
+    OID table builds, so unchanged builds can be skipped. It is kept in the project
+    directory and stores the file names relative to it, so the project can be built
+    as "." or by any other path. They are returned as paths like getProjectPath().
+    """
+    try:
+        manifest = decodeJson(readStringFromFile(manifestFileName))
+        if manifest.get("version") == version:
+            return mapManifestPaths(manifest, lambda x: getProjectPath(os.path.dirname(manifestFileName), x))
+    except (IOError, ValueError):
+        pass
+    return {"version": version}
+    
+    
+def writeManifest(manifestFileName, manifest):
+    """Write build manifest. See readManifest().
+    """
+    manifest = mapManifestPaths(manifest, lambda x: os.path.relpath(x, os.path.dirname(manifestFileName) or "."))
+    writeStringToFile(manifestFileName, json.dumps(manifest, indent=1, sort_keys=True))
+    
+    
+def getFileStates(fileNames):
+    """Return dict which maps each existing file to [size, mtime] or, for --checksum, [size, mtime, sha1].
+    """
+    states = {}
+    for fileName in fileNames:
+        if os.path.exists(fileName):
+            stat = os.stat(fileName)
+            states[fileName] = [stat.st_size, stat.st_mtime]
+            if options.checksum:
+                states[fileName].append(hashFile(fileName))
+    return states
+    
+    
+def areFilesUnchanged(states, fileNames):
+    """Return True iff exactly the files fileNames exist and match their states from getFileStates().
+    
+    Files with a different mtime are still unchanged if their sha1 matches (--checksum).
+    """
+    if sorted(states.keys()) != sorted(set(fileNames)):
+        return False
+    for fileName in fileNames:
+        if not os.path.exists(fileName):
+            return False
+        stat = os.stat(fileName)
+        state = states[fileName]
+        if stat.st_size != state[0]:
+            return False
+        if stat.st_mtime != state[1] and not (options.checksum and len(state) > 2 and hashFile(fileName) == state[2]):
+            return False
+    return True
+
+    
+def getChangedFiles(states, fileNames):
+    """Return the list of files which do not match their states from getFileStates().
+    
+    Return None if not exactly the files fileNames exist.
+    """
+    if sorted(states.keys()) != sorted(set(fileNames)) or not all([os.path.exists(x) for x in fileNames]):
+        return None
+    return [x for x in fileNames if not areFilesUnchanged({x: states[x]}, [x])]
+    
+    
+def readCodesYaml(codesYamlFileName):
+    """Read foo.codes.yaml file and return dict which maps script names to codes.
+    """
+    codes = {}
+    for line in readStringFromFile(codesYamlFileName).splitlines():
+        if not line.startswith("  "):
+            continue
+        fields = line.split(":")
+        if len(fields) < 2:
+            continue
+        codes[fields[0].strip()] = int(fields[1])
+    return codes
+    
+    
+def getHighestNamedOid(codesYamlFileName):
+    """Read foo.codes.yaml file and detremine highest used code.
+    """
+    max = 0
+    for oid in readCodesYaml(codesYamlFileName).values():
+        if oid > max:
+            max = oid
+    if options.verbose:
+        print "Highest used code: %d" % max
+    return max
+    
+    
+def getYamlProductId(yamlFileName, default):
+    """Return product-id from the *.yaml file or default if there is none.
+    """
+    match = re.search("^product-id: *([0-9]+)", readStringFromFile(yamlFileName), re.MULTILINE)
+    if match:
+        return int(match.group(1))
+    return default
+    
+    
+def getAdditionalOids(numNamedOids, totalOids, codesYamlFileName):
+    """Return list of additional oids, beyond the ones which are generated by the YAML file.
+    For future extension without re-printing oids.
+    """
+    if totalOids <= numNamedOids:
+        return []
+    highestNamedOid = getHighestNamedOid(codesYamlFileName)
+    start = highestNamedOid + 1
+    num = totalOids - numNamedOids
+    return range(start, start + num)
+
+
+def formatOidRanges(oids):
+    """Format list of oids as tttool range list, e.g. [1, 3, 4, 5] as "1,3-5".
+    """
+    oids = sorted(oids)
+    ranges = []
+    start = 0
+    for i in range(1, len(oids) + 1):
+        if i == len(oids) or oids[i] != oids[i - 1] + 1:
+            if i - 1 == start:
+                ranges.append("%d" % oids[start])
+            else:
+                ranges.append("%d-%d" % (oids[start], oids[i - 1]))
+            start = i
+    return ",".join(ranges)
+
+
+def generateOids(oids, dstdir, tttool):
+    """Generate oid-N.png files for a list of oids in directory dstdir using a single tttool invocation.
+    """
+    if not oids:
+        return
+    if options.verbose:
+        print "Generating %d oids into %s" % (len(oids), dstdir)
+    run(tttool + " oid-code -d " + options.dpi + " " + formatOidRanges(oids), dstdir)
+
+
+# Version of getOidPixels(). Part of the keys of natively generated OID patterns.
+oidGeneratorVersion = 1
+
+# Size of the OID patterns of tttool oid-code (its default --code-dim) in mm.
+oidCodeSizeMm = 30
+
+# Oids whose patterns are compared with the ones of tttool before --oid-generator auto uses native.
+oidGeneratorProbes = [1, 901, 1001, 4711, 9999]
+
+# Results of checkOidGenerator() in this process by its key.
+oidGeneratorChecks = {}
+
+
+def getOidChecksum(oid):
+    """Return the checksum digit (0-3) of the OID pattern of oid, like tttool.
+    """
+    c1 = (((oid >> 2) ^ (oid >> 8) ^ (oid >> 12) ^ (oid >> 14)) & 1) << 1
+    c2 = c1 | ((oid ^ (oid >> 4) ^ (oid >> 6) ^ (oid >> 10)) & 1)
+    return c2 ^ 2
+
+
+def getOidPixels(oid, dpi):
+    """Return the OID pattern of oid for dpi (600, 600d, 1200 or 1200d) as RGBA NumPy array (--oid-generator native).
+    
+    This is the pattern of tttool oid-code: Blocks of 4x4 dots, dpi/100 pixels
+    apart, repeated over the whole image. The dots of the first row and column
+    mark the blocks, the one in the third row of the first column is shifted to
+    the right and marks their orientation. The other 9 dots are shifted
+    diagonally by their value: The checksum and the 8 base 4 digits of oid
+    (most significant first). Black dots on a transparent background.
+    """
+    resolution = int(dpi.rstrip("d"))
+    spacing = resolution / 100
+    shift = resolution / 600
+    dotSize = shift * (2 if dpi.endswith("d") else 1)
+    blockSize = 4 * spacing
+    size = int(oidCodeSizeMm * resolution / 25.4)
+    shifts = [(shift, shift), (-shift, shift), (-shift, -shift), (shift, -shift)]
+    digits = [getOidChecksum(oid)] + [(oid >> (2 * i)) & 3 for i in range(7, -1, -1)]
+    dots = [(x, 0, 0, 0) for x in range(4)] + [(0, 1, 0, 0), (0, 2, shift, 0), (0, 3, 0, 0)]
+    dots += [(x, y) + shifts[digits[(y - 1) * 3 + x - 1]] for y in range(1, 4) for x in range(1, 4)]
+    block = numpy.zeros((blockSize, blockSize), numpy.uint8)
+    for (x, y, dx, dy) in dots:
+        left = x * spacing + spacing / 2 - dotSize / 2 + dx
+        top = y * spacing + spacing / 2 - dotSize / 2 + dy
+        block[top:top + dotSize, left:left + dotSize] = 255
+    # Only whole blocks.
+    numBlocks = size / blockSize
+    pixels = numpy.zeros((size, size, 4), numpy.uint8)
+    pixels[:numBlocks * blockSize, :numBlocks * blockSize, 3] = numpy.tile(block, (numBlocks, numBlocks))
+    return pixels
+    
+    
+def openOidImage(origOid, dpi):
+    """Return OID pattern as RGBA image: origOid is either a PNG file written by tttool oid-code or an oid, whose pattern is generated in memory (see getOidPixels()).
+    """
+    if isinstance(origOid, basestring):
+        return Image.open(origOid).convert("RGBA")
+    return Image.fromarray(getOidPixels(origOid, dpi), "RGBA")
+    
+    
+def writeOidNative(oid, dpi, fileName):
+    """Write the OID pattern of oid as PNG file like tttool oid-code (--oid-generator native).
+    """
+    Image.fromarray(getOidPixels(oid, dpi), "RGBA").save(fileName)
+    
+    
+def isOidImageIdentical(fileName, pixels):
+    """Return True iff the image file has the size and the pixels of the RGBA NumPy array pixels.
+    
+    The color of transparent pixels does not matter.
+    """
+    image = numpy.asarray(Image.open(fileName).convert("RGBA"))
+    if image.shape != pixels.shape:
+        return False
+    visible = pixels[:, :, 3] > 0
+    return bool((image[:, :, 3] == pixels[:, :, 3]).all() and (image[visible] == pixels[visible]).all())
+    
+    
+def checkOidGenerator(tttool):
+    """Return True iff getOidPixels() generates the same patterns as tttool for --dpi.
+    
+    The patterns of oidGeneratorProbes are compared. The result is kept in the
+    machine-wide cache (--cache-dir) by --dpi and the contents of tttool, so
+    tttool only runs once per machine, tttool version and --dpi. Raise Error if
+    tttool fails.
+    """
+    key = hashStrings("oid-generator", oidGeneratorVersion, options.dpi, getToolHash(tttool))
+    if key in oidGeneratorChecks:
+        return oidGeneratorChecks[key]
+    dirName = getCacheSubDir("oids")
+    cacheFileName = dirName + "/" + key + ".json"
+    try:
+        identical = json.loads(readStringFromFile(cacheFileName))["identical"]
+        os.utime(cacheFileName, None)
+    except (IOError, OSError, ValueError, KeyError):
+        tmpDir = tempfile.mkdtemp(".tmp", "oid-check-", dirName)
+        try:
+            generateOids(oidGeneratorProbes, tmpDir, tttool)
+            identical = all([isOidImageIdentical(tmpDir + "/oid-%d.png" % x, getOidPixels(x, options.dpi)) for x in oidGeneratorProbes])
+            writeStringToFile(tmpDir + "/result.json", json.dumps({"identical": identical}))
+            addToCache(tmpDir + "/result.json", cacheFileName)
+        finally:
+            shutil.rmtree(tmpDir, True)
+        if options.verbose:
+            print "Native OID patterns for %s dpi are %s to the ones of tttool" % (options.dpi, "identical" if identical else "not identical")
+    oidGeneratorChecks[key] = identical
+    return identical
+    
+    
+def getOidGenerator(tttool):
+    """Return the generator of the OID patterns selected by --oid-generator: "native" or "tttool".
+    
+    Both native and auto require that NumPy and Pillow are installed and that
+    the native patterns are identical to the ones of tttool (see checkOidGenerator()).
+    Otherwise auto uses tttool and native raises Error, so unverified patterns
+    are never printed.
+    """
+    if options.oid_generator == "tttool":
+        return "tttool"
+    if not numpy or not Image:
+        if options.oid_generator == "native":
+            raise Error("--oid-generator native requires NumPy and Pillow (pip install numpy pillow).")
+        return "tttool"
+    try:
+        identical = checkOidGenerator(tttool)
+    except Error as e:
+        if options.oid_generator == "native":
+            raise Error("--oid-generator native requires tttool to check the native OID patterns: %s" % e.message)
+        if options.verbose:
+            print "Unable to check the native OID patterns: %s" % e.message
+        return "tttool"
+    if not identical and options.oid_generator == "native":
+        raise Error("The native OID patterns for %s dpi differ from the ones of tttool. Please use --oid-generator tttool." % options.dpi)
+    return "native" if identical else "tttool"
+
+
+def hashStrings(*items):
+    """Return hex digest of a list of strings (or values convertible to strings).
+    """
+    return hashlib.sha1("\0".join([str(x) for x in items])).hexdigest()
+    
+
+def hashFile(fileName):
+    """Return hex digest of the contents of a file.
+    """
+    return hashlib.sha1(readStringFromFile(fileName)).hexdigest()
+    
+
+def getToolSignature(tool):
+    """Return a string which changes whenever the executable tool is replaced.
+    """
+    path = tool if os.path.exists(tool) else distutils.spawn.find_executable(tool)
+    if not path:
+        return tool
+    stat = os.stat(path)
+    return "%s:%d:%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    
+    
+# Maps tool signatures to the hashes of the tools, see getToolHash().
+toolHashes = {}
+
+
+def getToolHash(tool):
+    """Return hex digest of the contents of the executable tool.
+    
+    Unlike getToolSignature() this does not depend on the path of the tool, so
+    all copies of the same tttool version share the OID cache (see getCachedOids()).
+    """
+    signature = getToolSignature(tool)
+    if signature not in toolHashes:
+        path = tool if os.path.exists(tool) else distutils.spawn.find_executable(tool)
+        toolHashes[signature] = hashFile(path) if path else hashStrings(tool)
+    return toolHashes[signature]
+    
+    
+indexFileName = ".ogg2gme-index"
+
+
+def readIndex(dirName):
+    """Read index of dirName, which maps the generated files to the keys of their inputs.
+    Return an empty index if there is no valid index.
+    """
+    try:
+        index = decodeJson(readStringFromFile(dirName + "/" + indexFileName))
+        if isinstance(index.get("files"), dict):
+            return index
+    except (IOError, ValueError):
+        pass
+    return {"files": {}}
+    
+    
+def writeIndex(dirName, index):
+    """Write index of dirName. See readIndex().
+    """
+    writeStringToFile(dirName + "/" + indexFileName, json.dumps(index, indent=1, sort_keys=True))
+
+
+def updateFiles(dirName, pattern, index, keys, generate):
+    """Bring the generated files in dirName which match the glob pattern up to date.
+    
+    keys maps each wanted file name to the key of its inputs. generate is called
+    with the list of files whose key changed (or which are missing) and must
+    (re-)generate them. Files which are no longer wanted are removed.
+    Return list of regenerated file names.
+    """
+    stale = getStaleFiles(dirName, pattern, index, keys)
+    if stale:
+        generate(stale)
+    finishFiles(dirName, index, keys, stale)
+    return stale
+
+
+def getStaleFiles(dirName, pattern, index, keys):
+    """First half of updateFiles(): Remove unwanted files and return the list of files which must be (re-)generated.
+    
+    Call finishFiles() once they are generated.
+    """
+    files = index["files"]
+    for fileName in set(files.keys() + [os.path.basename(x) for x in glob.glob(dirName + "/" + pattern)]):
+        if fileName not in keys:
+            if os.path.exists(dirName + "/" + fileName):
+                os.remove(dirName + "/" + fileName)
+            files.pop(fileName, None)
+    stale = sorted([x for x in keys if options.force or files.get(x) != keys[x] or not os.path.exists(dirName + "/" + x)])
+    for fileName in stale:
+        files.pop(fileName, None)
+    writeIndex(dirName, index)
+    if options.verbose and stale:
+        print "Regenerating %d of %d files in %s" % (len(stale), len(keys), dirName)
+    return stale
+
+
+def finishFiles(dirName, index, keys, stale):
+    """Second half of updateFiles(): Record the keys of the (re-)generated stale files in the index.
+    """
+    for fileName in stale:
+        index["files"][fileName] = keys[fileName]
+    writeIndex(dirName, index)
+
+
+def removeFiles(pattern):
+    """Remove files matching glob pattern.
+    """
+    for f in glob.glob(pattern):
+        os.remove(f)
+    
+        
+def mkdir(path):
+    """Make directory if it does not yet exist.
+    """
+    if os.path.isdir(path):
+        return
+    os.mkdir(path)
+
+    
+def rmdir(path):
+    """Try to remove empty directory. Do nothing if the directory is not empty or does not exist.
+    """
+    try:
+        os.rmdir(path)
+    except:
+        pass
+    
+    
+def getDefaultCacheDir():
+    """Return the default machine-wide cache directory (see --cache-dir).
+    """
+    if isWindows():
+        return os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "ogg2gme", "cache")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ogg2gme")
+    
+    
+def getCacheSubDir(name):
+    """Return directory name in the machine-wide cache (--cache-dir). Create it if necessary.
+    """
+    dirName = options.cache_dir + "/" + name
+    try:
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+    except OSError as e:
+        if not os.path.isdir(dirName):
+            raise Error("Unable to create cache directory %s (%s). Please set a writable directory with --cache-dir." % (dirName, e.strerror))
+    return dirName
+
+
+def addToCache(tmpFileName, cacheFileName):
+    """Move a generated file into the machine-wide cache.
+    
+    The rename is atomic, so concurrent builds (e.g. --batch) never see partial files.
+    """
+    try:
+        os.rename(tmpFileName, cacheFileName)
+    except OSError:
+        # Windows does not replace existing files. Another build added the same file meanwhile.
+        try:
+            os.remove(tmpFileName)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def evictCache(keep):
+    """Remove the least recently used files from the machine-wide cache until it is at most --cache-size MB large.
+    
+    Cache users mark files as used by updating their mtime. The files in the
+    list keep (which are about to be used) are never removed.
+    """
+    files = []
+    for (dirName, subDirs, fileNames) in os.walk(options.cache_dir):
+        for fileName in fileNames:
+            fileName = os.path.join(dirName, fileName)
+            try:
+                stat = os.stat(fileName)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, fileName))
+    totalSize = sum([x[1] for x in files])
+    keep = set([os.path.abspath(x) for x in keep])
+    for (mtime, size, fileName) in sorted(files):
+        if totalSize <= options.cache_size * 1024 * 1024:
+            break
+        if os.path.abspath(fileName) in keep:
+            continue
+        try:
+            os.remove(fileName)
+        except OSError:
+            pass
+        totalSize -= size
+    
+    
+def getCachedShape(shapeFile, size, shapeKey):
+    """Return (shapeFileName, maskFileName): shapeFile resized to size like 'convert -sample' and its alpha mask.
+    
+    Both are generated once per shapeKey (contents of shapeFile and size) and kept
+    in the machine-wide cache (--cache-dir), so the convert commands for the
+    individual OIDs only have to composite the OID pattern. Call evictCache()
+    afterwards.
+    """
+    dirName = getCacheSubDir("shapes")
+    fileNames = (dirName + "/" + shapeKey + ".png", dirName + "/" + shapeKey + "-mask.png")
+    if not all([os.path.exists(x) for x in fileNames]):
+        # Each call generates into its own directory, as concurrent builds may run in the same process (see Project).
+        tmpDir = tempfile.mkdtemp(".tmp", "shape-", dirName)
+        try:
+            tmpFileNames = [tmpDir + "/" + os.path.basename(x) for x in fileNames]
+            run("convert %s -sample %dx%d %s" % (shapeFile, size[0], size[1], tmpFileNames[0]))
+            run("convert %s -sample %dx%d -alpha extract %s" % (shapeFile, size[0], size[1], tmpFileNames[1]))
+            for (tmpFileName, fileName) in zip(tmpFileNames, fileNames):
+                addToCache(tmpFileName, fileName)
+        finally:
+            shutil.rmtree(tmpDir, True)
+    for fileName in fileNames:
+        os.utime(fileName, None)
+    return fileNames
+    
+
+def getCachedOids(fileNameToOid, dstDir, tttool):
+    """Copy the oid-code images of tttool for fileNameToOid (file name -> oid) into dstDir.
+    
+    The images are kept in the machine-wide cache (--cache-dir) by oid, --dpi
+    and the contents of tttool, so each pattern is generated only once on this
+    machine. Missing ones are generated by a single tttool invocation into a
+    private directory and then renamed into the cache, so concurrent builds
+    (e.g. --batch) never see partial files. Return the number of generated oids.
+    """
+    dirName = getCacheSubDir("oids")
+    toolHash = getToolHash(tttool)
+    cacheFileNames = dict([(x, dirName + "/" + hashStrings("oid", x, options.dpi, toolHash) + ".png") for x in set(fileNameToOid.values())])
+    missing = set()
+    for (fileName, oid) in sorted(fileNameToOid.items()):
+        try:
+            shutil.copyfile(cacheFileNames[oid], dstDir + "/" + fileName)
+            os.utime(cacheFileNames[oid], None)
+        except (IOError, OSError):
+            # Not cached yet or just evicted by a concurrent build.
+            missing.add(oid)
+    if options.verbose:
+        print "Found %d of %d oids in %s" % (len(cacheFileNames) - len(missing), len(cacheFileNames), dirName)
+    if missing:
+        tmpDir = tempfile.mkdtemp(".tmp", "oid-code-", dirName)
+        try:
+            generateOids(sorted(missing), tmpDir, tttool)
+            for (fileName, oid) in fileNameToOid.items():
+                if oid in missing:
+                    shutil.copyfile(tmpDir + "/oid-%d.png" % oid, dstDir + "/" + fileName)
+            for oid in missing:
+                addToCache(tmpDir + "/oid-%d.png" % oid, cacheFileNames[oid])
+        finally:
+            shutil.rmtree(tmpDir, True)
+    evictCache(cacheFileNames.values())
+    return len(missing)
+    
+
+def getRenderer():
+    """Return the renderer for boxes and labels selected by --renderer: Either "native" or "imagemagick".
+    """
+    if options.renderer == "auto":
+        return "native" if Image else "imagemagick"
+    if options.renderer == "native" and not Image:
+        raise Error("--renderer native requires the Python Imaging Library (Pillow).")
+    return options.renderer
+    
+    
+# Per process caches of the native renderer.
+nativeShapes = {}
+nativeFonts = {}
+
+
+def loadShapeNative(shapeFile, size):
+    """Load shape file, resized to size like 'convert -sample', as RGBA image.
+    """
+    key = (shapeFile, size)
+    if key not in nativeShapes:
+        # NEAREST picks the source pixel under the center of each destination pixel, like -sample.
+        nativeShapes[key] = Image.open(shapeFile).convert("RGBA").resize(size, Image.NEAREST)
+    return nativeShapes[key]
+
+
+def loadFontNative(fontName, pointSize):
+    """Load TrueType font for label texts. If fontName is empty try some common fonts.
+    """
+    key = (fontName, pointSize)
+    if key not in nativeFonts:
+        candidates = [fontName] if fontName else ["DejaVuSans.ttf", "arial.ttf", "Arial.ttf", "LiberationSans-Regular.ttf", "Helvetica.ttc"]
+        for candidate in candidates:
+            try:
+                nativeFonts[key] = ImageFont.truetype(candidate, pointSize)
+                break
+            except IOError:
+                pass
+        else:
+            raise IOError("Unable to load font %s. Please specify a TrueType font with --font." % candidates[0])
+    return nativeFonts[key]
+
+
+# Colors tried for the transparent pixels of palette images, see getCompactImage().
+transparentKeyColors = [(255, 0, 255), (0, 255, 255), (1, 2, 3), (254, 253, 252)]
+
+
+def getNumBits(numColors):
+    """Return the smallest PNG bit depth (1, 2, 4 or 8) for a palette of numColors colors.
+    """
+    return [x for x in (1, 2, 4, 8) if numColors <= 1 << x][0]
+
+
+def getCompactImage(image):
+    """Return (image, bits): image converted to its smallest exact PNG representation (--compact-png).
+    
+    Black and white images become 1 bit images. Images with at most 256 colors
+    and only fully transparent or opaque pixels become palette images with
+    bits bits per pixel. Other images are returned unchanged with bits None.
+    """
+    original = image
+    transparent = None
+    if image.mode == "RGBA":
+        alpha = image.split()[3]
+        alphaValues = set([x[1] for x in alpha.getcolors()])
+        if not alphaValues <= set([0, 255]):
+            return (original, None)
+        image = image.convert("RGB")
+        if 0 in alphaValues:
+            # Paint the transparent pixels in a color which no opaque pixel has.
+            numTransparent = alpha.histogram()[0]
+            for transparent in transparentKeyColors:
+                keyed = image.copy()
+                keyed.paste(transparent, mask=ImageChops.invert(alpha))
+                if dict([(x[1], x[0]) for x in keyed.getcolors(256) or []]).get(transparent) == numTransparent:
+                    image = keyed
+                    break
+            else:
+                return (original, None)
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    colors = image.getcolors(256)
+    if colors is None:
+        return (original, None)
+    if transparent is None and set([x[1] for x in colors]) <= set([(0, 0, 0), (255, 255, 255)]):
+        return (image.convert("1", dither=Image.NONE), 1)
+    # Map the pixels to a palette of exactly their colors. Pillow looks colors up with reduced precision,
+    # so check the result and else use an adaptive palette, which is slower, but exact for up to 256 colors.
+    isExact = lambda x: x.getextrema()[1] < len(colors) and not ImageChops.difference(x.convert("RGB"), image).getbbox()
+    palette = [y for x in colors for y in x[1]]
+    paletteImage = Image.new("P", (1, 1))
+    paletteImage.putpalette(palette + [0] * (768 - len(palette)))
+    paletteImage = image.quantize(palette=paletteImage)
+    if not isExact(paletteImage):
+        paletteImage = image.convert("P", palette=Image.ADAPTIVE, colors=len(colors))
+        if not isExact(paletteImage):
+            return (original, None)
+    if transparent is not None:
+        palette = paletteImage.getpalette()
+        paletteImage.info["transparency"] = [tuple(palette[i * 3:i * 3 + 3]) for i in range(len(colors))].index(transparent)
+    return (paletteImage, getNumBits(len(colors)))
+    
+    
+def savePngNative(image, fileName, dpi=None, compact=False):
+    """Save image as PNG file. With compact (--compact-png) in its smallest exact representation and with the best zlib compression.
+    """
+    info = {"dpi": (dpi, dpi)} if dpi else {}
+    if compact:
+        (image, bits) = getCompactImage(image)
+        info["compress_level"] = 9
+        if image.mode == "P":
+            info["bits"] = bits
+    image.save(fileName, **info)
+    
+
+def renderOidNative(origOid, boxOidFileName, labelOidFileName, name, shapeFile, layout):
+    """Render box and label PNG for one OID pattern (file name or oid, see openOidImage()) in memory (--renderer native).
+    
+    This is the Pillow equivalent of the box/shape and label convert commands
+    in buildOidTable(). shapeFile is None for (custom) boxes. Return the seconds
+    spent on the box and on the label as dict of phases (see runTask()).
+    """
+    startTime = time.time()
+    oid = openOidImage(origOid, layout["oidDpi"])
+    if shapeFile is None:
+        # Crop inner box and add border.
+        (innerWidth, innerHeight) = layout["boxInnerSize"]
+        borderWidth = layout["boxBorderWidth"]
+        inner = oid.crop((0, 0, min(innerWidth, oid.size[0]), min(innerHeight, oid.size[1])))
+        box = Image.new("RGBA", (inner.size[0] + 2 * borderWidth, inner.size[1] + 2 * borderWidth), ImageColor.getcolor(layout["boxBorderColor"], "RGBA"))
+        box.paste(inner, (borderWidth, borderWidth))
+        savePngNative(box, boxOidFileName, 600, layout["compact"])
+    else:
+        # Flatten pattern over shape on white background and use the shape alpha as mask.
+        shape = loadShapeNative(shapeFile, layout["boxTotalSize"])
+        box = Image.alpha_composite(Image.new("RGBA", shape.size, (255, 255, 255, 255)), shape)
+        box = Image.alpha_composite(box, oid.crop((0, 0) + shape.size))
+        box.putalpha(shape.split()[3])
+        savePngNative(box, boxOidFileName, None, layout["compact"])
+    boxTime = time.time()
+        
+    # Extend box to column width on white, annotate with name and add white border.
+    (columnWidth, boxHeight) = (layout["columnWidth"], layout["boxTotalSize"][1])
+    label = Image.new("RGBA", (columnWidth, boxHeight), (255, 255, 255, 255))
+    label = Image.alpha_composite(label, box.crop((0, 0, columnWidth, boxHeight)))
+    font = loadFontNative(layout["font"], layout["textPointSize"])
+    (ascent, descent) = font.getmetrics()
+    draw = ImageDraw.Draw(label)
+    if layout["compact"]:
+        # Without anti-aliasing the text is black only, so the pages fit into a small palette.
+        draw.fontmode = "1"
+    draw.text((layout["textOffset"], (boxHeight - ascent - descent) / 2), name, font=font, fill=(0, 0, 0, 255))
+    labelBorderWidth = layout["labelBorderWidth"]
+    bordered = Image.new("RGB", (columnWidth + 2 * labelBorderWidth, boxHeight + 2 * labelBorderWidth), (255, 255, 255))
+    bordered.paste(label.convert("RGB"), (labelBorderWidth, labelBorderWidth))
+    savePngNative(bordered, labelOidFileName, None, layout["compact"])
+    return {"boxes": boxTime - startTime, "labels": time.time() - boxTime}
+    
+
+class PngWriter:
+    """Write an 8 bit RGB PNG file strip by strip, without keeping the whole image in memory.
+    
+    colorType 0 and bitDepth 1 write a black and white image instead. With a
+    palette (list of (r, g, b) tuples) a palette image with bitDepth bits per
+    pixel is written. fileName may also be a file object (e.g. StringIO), which
+    is not closed by close().
+    """
+    def __init__(self, fileName, width, height, dpi, bitDepth=8, colorType=2, palette=None, compressLevel=6):
+        if palette:
+            colorType = 3
+        self.rowSize = (width * {0: 1, 2: 3, 3: 1}[colorType] * bitDepth + 7) / 8
+        self.isOwnFile = isinstance(fileName, basestring)
+        self.file = open(fileName, "wb") if self.isOwnFile else fileName
+        self.file.write("\x89PNG\r\n\x1a\n")
+        self.writeChunk("IHDR", struct.pack(">IIBBBBB", width, height, bitDepth, colorType, 0, 0, 0))
+        if palette:
+            self.writeChunk("PLTE", "".join([struct.pack("BBB", *x) for x in palette]))
+        pixelsPerMeter = int(round(dpi / 0.0254))
+        self.writeChunk("pHYs", struct.pack(">IIB", pixelsPerMeter, pixelsPerMeter, 1))
+        self.compressor = zlib.compressobj(compressLevel, zlib.DEFLATED, 15, 9 if compressLevel == 9 else 8)
+        
+    def writeChunk(self, chunkType, data):
+        """Write one PNG chunk.
+        """
+        self.file.write(struct.pack(">I", len(data)) + chunkType + data + struct.pack(">I", zlib.crc32(chunkType + data) & 0xffffffff))
+        
+    def writeRows(self, data):
+        """Write rows of raw RGB data (or packed bits or palette indices). data must contain whole rows.
+        """
+        rowSize = self.rowSize
+        rows = "".join(["\0" + data[i:i + rowSize] for i in range(0, len(data), rowSize)])
+        compressed = self.compressor.compress(rows)
+        if compressed:
+            self.writeChunk("IDAT", compressed)
+        
+    def close(self):
+        """Write remaining data and close file.
+        """
+        self.writeChunk("IDAT", self.compressor.flush())
+        self.writeChunk("IEND", "")
+        if self.isOwnFile:
+            self.file.close()
+        
+
+def readPaletteImage(fileName):
+    """Read image file with at most 256 colors as (colors, indices) for composePageNative().
+    
+    indices is an L image of indices into colors, a list of (r, g, b) tuples.
+    Return None if the image has more colors.
+    """
+    image = Image.open(fileName)
+    if image.mode not in ("P", "1"):
+        image = getCompactImage(image.convert("RGB"))[0]
+    if image.mode == "1":
+        return ([(0, 0, 0), (255, 255, 255)], image.convert("L").point(lambda x: x / 255))
+    if image.mode != "P":
+        return None
+    palette = image.getpalette() + [0] * 768
+    return ([tuple(palette[i * 3:i * 3 + 3]) for i in range(256)], Image.frombytes("L", image.size, image.tobytes()))
+    
+
+def composePageNative(labelRows, pageWidth, dpi, pageFileName, compact=False):
+    """Compose one page of labels in memory (--renderer native).
+    
+    labelRows is a list of rows, each a list of label files. Labels may differ in
+    width (see --layout pack). Each label is framed by a gray border like
+    'montage -border 20 LABELS -mode Concatenate -tile COLUMNSx PAGE' does.
+    The page is written strip by strip, so only one row of labels is in memory at any time.
+    With compact (--compact-png) the page is a palette image if the labels and borders
+    together have at most 256 colors. Its strips are then composed of palette indices.
+    """
+    border = 20
+    tileHeight = Image.open(labelRows[0][0]).size[1] + 2 * border
+    palette = None
+    if compact:
+        colors = set([(255, 255, 255), (0xdf, 0xdf, 0xdf)])
+        for labelFileName in set(sum(labelRows, [])):
+            label = readPaletteImage(labelFileName)
+            if label is None:
+                break
+            colors.update([label[0][x[1]] for x in label[1].getcolors(256)])
+        if label is not None and len(colors) <= 256:
+            palette = sorted(colors)
+            paletteIndex = dict([(x, i) for (i, x) in enumerate(palette)])
+    if palette:
+        bits = getNumBits(len(palette))
+        writer = PngWriter(pageFileName, pageWidth, len(labelRows) * tileHeight, dpi, bits, palette=palette, compressLevel=9)
+        (mode, white, gray) = ("L", paletteIndex[(255, 255, 255)], paletteIndex[(0xdf, 0xdf, 0xdf)])
+    else:
+        writer = PngWriter(pageFileName, pageWidth, len(labelRows) * tileHeight, dpi, compressLevel=9 if compact else 6)
+        (mode, white, gray) = ("RGB", (255, 255, 255), (0xdf, 0xdf, 0xdf))
+    try:
+        for labelFileNames in labelRows:
+            strip = Image.new(mode, (pageWidth, tileHeight), white)
+            x = 0
+            for labelFileName in labelFileNames:
+                if palette:
+                    (labelColors, label) = readPaletteImage(labelFileName)
+                    label = label.point([paletteIndex.get(color, 0) for color in labelColors])
+                    mask = None
+                else:
+                    label = mask = Image.open(labelFileName).convert("RGBA")
+                (labelWidth, labelHeight) = label.size
+                strip.paste(gray, (x, 0, x + labelWidth + 2 * border, tileHeight))
+                strip.paste(white, (x + border, border, x + border + labelWidth, border + labelHeight))
+                strip.paste(label, (x + border, border), mask)
+                x += labelWidth + 2 * border
+            if palette:
+                writer.writeRows(Image.frombytes("P", strip.size, strip.tobytes()).tobytes("raw", "P;%d" % bits if bits < 8 else "P"))
+            else:
+                writer.writeRows(strip.tobytes())
+    finally:
+        writer.close()
+    
+
+# Matches one header field of a binary PBM/PPM file (skipping whitespace and comments).
+netpbmFieldRe = re.compile(r"(?:\s+|#[^\n]*\n)*(\S+)")
+
+
+def readNetpbm(fileName):
+    """Read binary PBM (P4) or PPM (P6) file. Return (width, height, data).
+    
+    PBM data has one bit per pixel (1 is black) and each row is padded to whole bytes.
+    """
+    data = readStringFromFile(fileName)
+    fields = []
+    pos = 0
+    while len(fields) < {"P4": 3, "P6": 4}.get(data[:2], 0):
+        match = netpbmFieldRe.match(data, pos)
+        if not match:
+            break
+        fields.append(match.group(1))
+        pos = match.end()
+    if not fields or not all([x.isdigit() for x in fields[1:]]):
+        raise Error("Unable to read %s. Expecting a binary PBM or PPM file." % fileName)
+    # Exactly one whitespace character separates the header from the data.
+    return (int(fields[1]), int(fields[2]), data[pos + 1:])
+    
+    
+# Colors for --shape box:...:COLOR without Pillow.
+basicColors = {"black": (0, 0, 0), "white": (255, 255, 255), "red": (255, 0, 0), "green": (0, 128, 0), "blue": (0, 0, 255), 
+               "yellow": (255, 255, 0), "orange": (255, 165, 0), "gray": (128, 128, 128), "grey": (128, 128, 128)}
+
+
+def parseColor(color):
+    """Return (r, g, b) of an ImageMagick/CSS color like red or #ff0000.
+    """
+    if Image:
+        try:
+            return ImageColor.getrgb(color)[:3]
+        except ValueError:
+            pass
+    elif color.lower() in basicColors:
+        return basicColors[color.lower()]
+    elif re.search("^#([0-9a-fA-F]{3}){1,2}$", color):
+        digits = color[1:] if len(color) == 7 else "".join([x * 2 for x in color[1:]])
+        return tuple([int(digits[i:i + 2], 16) for i in range(0, 6, 2)])
+    raise Error("Unknown color '%s'." % color)
+    
+    
+def renderDotsNative(origOid, dpi, dotsFileName, shapeFile, size):
+    """Write the dot pattern of one OID, cropped to size and masked by the shape, as PBM (--output-format pdf/svg).
+    
+    This is the Pillow equivalent of the dots convert commands in buildOidTable().
+    origOid is a file name or an oid (see openOidImage()). shapeFile is None for (custom) boxes.
+    """
+    oid = openOidImage(origOid, dpi)
+    dots = Image.alpha_composite(Image.new("RGBA", oid.size, (255, 255, 255, 255)), oid).convert("L")
+    dots = dots.crop((0, 0, min(size[0], dots.size[0]), min(size[1], dots.size[1])))
+    if shapeFile is not None:
+        dots = ImageChops.lighter(dots, ImageChops.invert(loadShapeNative(shapeFile, size).split()[3].crop((0, 0) + dots.size)))
+    dots.point(lambda x: 255 if x >= 128 else 0).convert("1").save(dotsFileName)
+    
+    
+def getShapeRgb(shapeFile, size, shapeKey, tmpDir):
+    """Return raw RGB data of shapeFile, resized to size like 'convert -sample' and flattened on white.
+    """
+    if getRenderer() == "native":
+        shape = loadShapeNative(shapeFile, size)
+        return Image.alpha_composite(Image.new("RGBA", size, (255, 255, 255, 255)), shape).convert("RGB").tobytes()
+    fileName = tmpDir + "/shape.ppm"
+    run("convert %s -background white -flatten %s" % (getCachedShape(shapeFile, size, shapeKey)[0], fileName))
+    data = readNetpbm(fileName)[2]
+    os.remove(fileName)
+    return data
+    
+    
+def loadVectorImage(key, shapes):
+    """Return (isMask, width, height, data) of an image of getVectorPageOps().
+    
+    shapes maps the shape files to (width, height, RGB data), see getShapeRgb().
+    """
+    if key in shapes:
+        return (False,) + shapes[key]
+    return (True,) + readNetpbm(key)
+    
+    
+def getVectorPageOps(rows, layout):
+    """Return the drawing operations of one page of labels for --output-format pdf/svg.
+    
+    rows is a list of rows, each a list of (name, dotsFileName, shapeFile, width)
+    tuples with width being the label width without its border. All coordinates
+    are in pixels (at the DPI of the OIDs) from the top left corner of the page.
+    The operations are ("rect", x, y, width, height, (r, g, b)), ("image", key, x, y)
+    with key being a PBM dots file or a shape file, and ("text", x, y, text) with
+    y being the vertical center of the text. The layout is the one of the PNG pages:
+    Labels framed by gray borders like 'montage -border 20'.
+    """
+    (boxWidth, boxHeight) = layout["boxTotalSize"]
+    (innerWidth, innerHeight) = layout["boxInnerSize"]
+    borderWidth = layout["boxBorderWidth"]
+    labelBorderWidth = layout["labelBorderWidth"]
+    tileBorderWidth = layout["tileBorderWidth"]
+    labelHeight = boxHeight + 2 * labelBorderWidth
+    tileHeight = labelHeight + 2 * tileBorderWidth
+    (offsetX, offsetY) = layout["pageOffset"]
+    ops = []
+    for (row, labels) in enumerate(rows):
+        (x, y) = (offsetX, offsetY + row * tileHeight)
+        for (name, dotsFileName, shapeFile, width) in labels:
+            (labelWidth, tileWidth) = (width + 2 * labelBorderWidth, width + 2 * (labelBorderWidth + tileBorderWidth))
+            ops.append(("rect", x, y, tileWidth, tileHeight, (0xdf, 0xdf, 0xdf)))
+            ops.append(("rect", x + tileBorderWidth, y + tileBorderWidth, labelWidth, labelHeight, (255, 255, 255)))
+            (boxX, boxY) = (x + tileBorderWidth + labelBorderWidth, y + tileBorderWidth + labelBorderWidth)
+            if shapeFile is None:
+                ops.append(("rect", boxX, boxY, boxWidth, boxHeight, layout["boxBorderRgb"]))
+                ops.append(("rect", boxX + borderWidth, boxY + borderWidth, innerWidth, innerHeight, (255, 255, 255)))
+                ops.append(("image", dotsFileName, boxX + borderWidth, boxY + borderWidth))
+            else:
+                ops.append(("image", shapeFile, boxX, boxY))
+                ops.append(("image", dotsFileName, boxX, boxY))
+            ops.append(("text", layout["textOffset"] + boxX, boxY + boxHeight / 2, name))
+            x += tileWidth
+    return ops
+    
+    
+class PdfWriter:
+    """Write a PDF file object by object. Streams are compressed.
+    """
+    def __init__(self, fileName):
+        self.file = open(fileName, "wb")
+        self.file.write("%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = []
+        
+    def reserveObject(self):
+        """Return the number of a new object. It must be written with writeObject() before close().
+        """
+        self.offsets.append(None)
+        return len(self.offsets)
+        
+    def writeObject(self, number, data, stream=None):
+        """Write object: data is the PDF source of the object or, with stream, the entries of the stream dictionary.
+        """
+        self.offsets[number - 1] = self.file.tell()
+        if stream is None:
+            self.file.write("%d 0 obj\n%s\nendobj\n" % (number, data))
+        else:
+            stream = zlib.compress(stream, 6)
+            self.file.write("%d 0 obj\n<< %s /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (number, data, len(stream), stream))
+            
+    def close(self, rootNumber):
+        """Write cross reference table and trailer and close file.
+        """
+        xrefOffset = self.file.tell()
+        self.file.write("xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        self.file.write("".join(["%010d 00000 n \n" % x for x in self.offsets]))
+        self.file.write("trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets) + 1, rootNumber, xrefOffset))
+        self.file.close()
+        
+        
+def decodeLabelText(name):
+    """Return the label text name as unicode. Names are UTF-8 (or, if not valid UTF-8, Latin-1) like the *.yaml file.
+    """
+    if isinstance(name, unicode):
+        return name
+    try:
+        return name.decode("utf-8")
+    except UnicodeDecodeError:
+        return name.decode("latin-1")
+        
+        
+def escapePdfString(s):
+    """Return s as PDF string literal.
+    """
+    return "(" + s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+    
+    
+def writeOidTablePdf(pages, layout, shapes, pdfFileName):
+    """Write all pages (rows of labels, see getVectorPageOps()) into one PDF file.
+    
+    Each image is embedded only once: Dot patterns as 1 bit image masks, shapes
+    as RGB images, both at exactly one pixel per dot of the OID DPI. Boxes,
+    borders and texts (Helvetica) are vectors. See loadVectorImage() for shapes.
+    Texts are encoded like the font (WinAnsiEncoding, i.e. cp1252). Characters
+    which cp1252 does not contain are replaced by '?'.
+    """
+    scale = 72.0 / layout["dpi"]
+    (pageWidth, pageHeight) = layout["pageSize"]
+    fontSize = layout["textPointSize"]
+    writer = PdfWriter(pdfFileName)
+    (catalog, pageTree, resources, font) = [writer.reserveObject() for i in range(4)]
+    images = {}
+    pageObjects = []
+    for rows in pages:
+        # Flip the y axis and use pixels as unit.
+        content = ["%.6f 0 0 %.6f 0 %.4f cm" % (scale, -scale, pageHeight * scale)]
+        for op in getVectorPageOps(rows, layout):
+            if op[0] == "rect":
+                content.append("%.3f %.3f %.3f rg %d %d %d %d re f" % (tuple([x / 255.0 for x in op[5]]) + op[1:5]))
+            elif op[0] == "image":
+                if op[1] not in images:
+                    (isMask, width, height, data) = loadVectorImage(op[1], shapes)
+                    number = writer.reserveObject()
+                    writer.writeObject(number, "/Type /XObject /Subtype /Image /Width %d /Height %d %s" % (width, height, 
+                                       "/ImageMask true /BitsPerComponent 1 /Decode [1 0]" if isMask else "/ColorSpace /DeviceRGB /BitsPerComponent 8"), data)
+                    images[op[1]] = ("I%d" % len(images), width, height, number)
+                (name, width, height, number) = images[op[1]]
+                content.append("q 0 g %d 0 0 %d %d %d cm /%s Do Q" % (width, -height, op[2], op[3] + height, name))
+            else:
+                content.append("BT 0 g /F1 %d Tf 1 0 0 -1 %d %.1f Tm %s Tj ET" % (fontSize, op[1], op[2] + 0.35 * fontSize, 
+                               escapePdfString(decodeLabelText(op[3]).encode("cp1252", "replace"))))
+        contents = writer.reserveObject()
+        writer.writeObject(contents, "", "\n".join(content))
+        pageObjects.append(writer.reserveObject())
+        writer.writeObject(pageObjects[-1], "<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.4f %.4f] /Resources %d 0 R /Contents %d 0 R >>" % 
+                           (pageTree, pageWidth * scale, pageHeight * scale, resources, contents))
+    writer.writeObject(font, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    writer.writeObject(resources, "<< /Font << /F1 %d 0 R >> /XObject << %s >> >>" % (font, " ".join(["/%s %d 0 R" % (x[0], x[3]) for x in images.values()])))
+    writer.writeObject(pageTree, "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(["%d 0 R" % x for x in pageObjects]), len(pageObjects)))
+    writer.writeObject(catalog, "<< /Type /Catalog /Pages %d 0 R >>" % pageTree)
+    writer.close(catalog)
+    
+
+# Inverts packed bits (PBM: 1 is black, PNG: 0 is black).
+invertBits = "".join([chr(255 - i) for i in range(256)])
+
+
+def writeOidTableSvg(rows, layout, shapes, svgFileName):
+    """Write one page (rows of labels, see getVectorPageOps()) as SVG file.
+    
+    Like writeOidTablePdf(), but images are embedded as PNG files, once per page.
+    """
+    (pageWidth, pageHeight) = layout["pageSize"]
+    toMm = lambda x: x * 25.4 / layout["dpi"]
+    defs = []
+    images = {}
+    elements = []
+    for op in getVectorPageOps(rows, layout):
+        if op[0] == "rect":
+            elements.append('<rect x="%d" y="%d" width="%d" height="%d" fill="#%02x%02x%02x"/>' % (op[1:5] + op[5]))
+        elif op[0] == "image":
+            if op[1] not in images:
+                (isMask, width, height, data) = loadVectorImage(op[1], shapes)
+                png = StringIO.StringIO()
+                writer = PngWriter(png, width, height, layout["dpi"], *((1, 0) if isMask else (8, 2)))
+                if isMask:
+                    # White is transparent.
+                    writer.writeChunk("tRNS", struct.pack(">H", 1))
+                    data = data.translate(invertBits)
+                writer.writeRows(data)
+                writer.close()
+                images[op[1]] = "I%d" % len(images)
+                defs.append('<image id="%s" width="%d" height="%d" style="image-rendering:optimizeSpeed" xlink:href="data:image/png;base64,%s"/>' % 
+                            (images[op[1]], width, height, base64.b64encode(png.getvalue())))
+            elements.append('<use xlink:href="#%s" x="%d" y="%d"/>' % (images[op[1]], op[2], op[3]))
+        else:
+            elements.append('<text x="%d" y="%.1f">%s</text>' % (op[1], op[2] + 0.35 * layout["textPointSize"], xml.sax.saxutils.escape(decodeLabelText(op[3])).encode("utf-8")))
+    svg = ['<?xml version="1.0" encoding="UTF-8"?>', 
+           '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="%.2fmm" height="%.2fmm" viewBox="0 0 %d %d">' % 
+           (toMm(pageWidth), toMm(pageHeight), pageWidth, pageHeight),
+           '<defs>'] + defs + ['</defs>', '<g font-family="Helvetica, Arial, sans-serif" font-size="%d">' % layout["textPointSize"]] + elements + ['</g>', '</svg>']
+    writeStringToFile(svgFileName, "\n".join(svg) + "\n")
+    
+
+# Widths of the ASCII characters 32 to 126 of Helvetica (and Arial) in 1/1000 of the point size, from the Helvetica AFM file.
+helveticaWidths = [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556, 556, 556, 556, 556,
+                   556, 556, 278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+                   667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556,
+                   556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]
+
+
+def getTextWidth(text, layout, renderer):
+    """Return width of a label text in pixels.
+    
+    The native renderer measures the text with its font. The PDF and SVG output
+    use Helvetica. For ImageMagick, whose default font is unknown, the Helvetica
+    width is increased by 15%.
+    """
+    if renderer == "native" and options.output_format == "png":
+        return loadFontNative(layout["font"], layout["textPointSize"]).getsize(text)[0]
+    width = sum([helveticaWidths[ord(x) - 32] if 32 <= ord(x) < 127 else 1000 for x in decodeLabelText(text)]) * layout["textPointSize"] / 1000.0
+    if options.output_format == "png":
+        width *= 1.15
+    return int(math.ceil(width))
+
+
+def packLabels(widths, rowWidth, numRows):
+    """Pack labels of the given widths into as few pages as possible (--layout pack).
+    
+    All labels have the same height, so this packs them into rows of at most
+    rowWidth (first fit decreasing) and the rows into pages of numRows rows.
+    Return a list of pages, each a list of rows, each a list of label indices.
+    Rows are ordered by their first label and labels within a row by their index,
+    so the pages are read in about the original order.
+    """
+    rows = []
+    for i in sorted(range(len(widths)), key=lambda i: (-widths[i], i)):
+        for row in rows:
+            if row[0] >= widths[i]:
+                break
+        else:
+            row = [rowWidth, []]
+            rows.append(row)
+        row[0] -= widths[i]
+        row[1].append(i)
+    rows = sorted([sorted(x[1]) for x in rows])
+    return [rows[i:i + numRows] for i in range(0, len(rows), numRows)]
+    
+
+def buildOidTable(projectDir, usedScriptNames, startOid, codesYamlFileName, tttool):
+    """Generate oid-table PNG files (or a PDF file or SVG files, see --output-format) in projectDir. Return their names.
+    
+    usedScriptNames are the scripts of the *.yaml file and startOid is its product-id.
+    """
+    columns = options.num_columns
+    minAdditionalOids = options.num_additional_oids
+    oid_orig_dir = getProjectPath(projectDir, "oid_orig")
+    oid_box_dir = getProjectPath(projectDir, "oid_box")
+    oid_label_dir = getProjectPath(projectDir, "oid_label")
+    oid_dots_dir = getProjectPath(projectDir, "oid_dots")
+    powerOnFile = dataDir + "/power_on.gif" # Size does not matter. Should be around 376x376.
+    stopSymbolFile = dataDir + "/stop_gelb.gif" # Size does not matter. Should be around 376x376.
+    
+    # Tmm: All lengths in 1/10 mm.
+    
+    # Page layout.
+    columnWidth = 1900 / columns
+    pageHeight = 2800
+    textSep = 10
+    lineSep = 10
+    textPointSize = 72
+    dpi = 600.0
+    if options.dpi.startswith("1200"):
+        dpi *= 2
+        textPointSize *= 2
+    toPixel = lambda x : int(x * dpi / 25.4 / 10.0)
+    columnWidthPixel = toPixel(columnWidth)
+    pageHeightPixel = toPixel(pageHeight)
+    textSepPixel = toPixel(textSep)
+    lineSepPixel = toPixel(lineSep)
+
+    # Get --shape "box" parameters. Parse --shape=box:WIDTH:HEIGHT:BORDER_WIDTH:BORDER_COLOR spec.
+    # Defaults:
+    boxTotalWidthTmm = 160
+    boxTotalHeightTmm = 160
+    boxBorderWidthTmm = 10
+    boxBorderColor = "red"
+    if options.shape.startswith("box:"):
+        fields = options.shape.split(":")
+        if len(fields) >= 2:
+            boxTotalWidthTmm = castTo(fields[1], int, 1)
+            boxTotalHeightTmm = boxTotalWidthTmm
+        if len(fields) >= 3:
+            boxTotalHeightTmm = castTo(fields[2], int, 1)
+        if len(fields) >= 4:
+            boxBorderWidthTmm = castTo(fields[3], int, 1)
+        if len(fields) >= 5:
+            boxBorderColor = fields[4]            
+    boxInnerWidthPixel = toPixel(boxTotalWidthTmm - 2 * boxBorderWidthTmm)
+    boxInnerHeightPixel = toPixel(boxTotalHeightTmm - 2 * boxBorderWidthTmm)
+    boxBorderWidthPixel = toPixel(boxBorderWidthTmm)
+    boxTotalWidthPixel = boxInnerWidthPixel + 2 * boxBorderWidthPixel
+    boxTotalHeightPixel = boxInnerHeightPixel + 2 * boxBorderWidthPixel
+    
+    # Get number of oids per page. This depends on the box height.
+    labelTotalHeightPixel = boxTotalHeightPixel + 2 * (lineSepPixel / 2)
+    numRows = pageHeightPixel / labelTotalHeightPixel
+    numOidsPerPage = numRows * columns
+    # Width of a row of labels including their gray borders (see composePageNative()).
+    rowWidthPixel = columns * (columnWidthPixel + 2 * (lineSepPixel / 2 + 20))
+    
+    # Create output directories. Their contents are kept and only regenerated when their inputs change.
+    mkdir(oid_orig_dir)
+    for dirName in ([oid_box_dir, oid_label_dir] if options.output_format == "png" else [oid_dots_dir]):
+        mkdir(dirName)
+    origIndex = readIndex(oid_orig_dir)
+    renderer = getRenderer()
+    oidGenerator = getOidGenerator(tttool)
+    toolSignature = getToolSignature(tttool) if oidGenerator == "tttool" else "native:%d" % oidGeneratorVersion
+    getOidKey = lambda fileName: hashStrings("oid", oidFileNameToOid[fileName], options.dpi, toolSignature)
+    # The native renderer renders natively generated OID patterns in memory, without files in oid_orig_dir.
+    inMemory = oidGenerator == "native" and renderer == "native"
+
+    # Get named oids from the *.yaml file: START and one oid per script.
+    codes = readCodesYaml(codesYamlFileName)
+    oidFileNameToOid = {"oid-%d-START.png" % startOid: startOid}
+    for scriptName in usedScriptNames:
+        if scriptName in codes:
+            oidFileNameToOid["oid-%d-%s.png" % (codes[scriptName], scriptName)] = codes[scriptName]
+    namedFiles = oidFileNameToOid.keys()
+    
+    # Get additional oids.
+    numNamedOids = len(namedFiles) + (options.num_start_oid - 1) + (options.num_start_oid - 1)
+    totalOids = numOidsPerPage
+    while numNamedOids + minAdditionalOids > totalOids:
+        totalOids += numOidsPerPage
+    if options.layout == "pack":
+        # Pages are not filled up, as the labels per page are only known after packing.
+        totalOids = numNamedOids + minAdditionalOids
+    for oid in getAdditionalOids(numNamedOids, totalOids, codesYamlFileName):
+        oidFileNameToOid["oid-%d.png" % oid] = oid
+    origOidFiles = sorted(oidFileNameToOid.keys())
+    oidKeys = dict([(x, getOidKey(x)) for x in origOidFiles])
+    getOrigOid = lambda fileName: oidFileNameToOid[fileName] if inMemory else oid_orig_dir + "/" + fileName
+
+    # Generate missing or outdated oids natively or copy them from the machine-wide cache into oid_orig_dir. Oids which are not cached yet are generated by a single tttool invocation.
+    def generateOidFiles(fileNames):
+        if oidGenerator == "native":
+            runParallel([("Generating " + oid_orig_dir + "/" + x, writeOidNative, (oidFileNameToOid[x], options.dpi, oid_orig_dir + "/" + x)) for x in fileNames])
+        else:
+            getCachedOids(dict([(x, oidFileNameToOid[x]) for x in fileNames]), oid_orig_dir, tttool)
+    with Phase("oid-code"):
+        updateFiles(oid_orig_dir, "oid-*.png", origIndex, {} if inMemory else oidKeys, generateOidFiles)
+        
+    # Split into startOidFiles, namedOidFiles and numberedOidFiles and generate label names.
+    startOidFiles = []
+    stopOidFiles = []
+    namedOidFiles = []
+    numberedOidFiles = []
+    oidFileNameToName = {}
+    for fileName in origOidFiles:
+        if re.search("^oid-[0-9]+-START.png$", fileName):
+            startOidFiles.append(fileName)
+            oidFileNameToName[fileName] = "START"
+        elif re.search("^oid-[0-9]+-STOP.png$", fileName):
+            stopOidFiles.append(fileName)
+            oidFileNameToName[fileName] = "STOP"
+        else:
+            match = re.search("^oid-([0-9]+).png$", fileName)
+            if match:
+                numberedOidFiles.append(fileName)
+                oidFileNameToName[fileName] = "ext_" + match.group(1)
+            else:
+                match = re.search("^oid-[0-9]+-(.+).png$", fileName)
+                if match:
+                    namedOidFiles.append(fileName)    
+                    oidFileNameToName[fileName] = match.group(1)
+                else:
+                    print "Ignoring PNG %s" % fileName
+
+    # Get symbol to composite each OID pattern into. None means (custom) box.
+    oidFileNameToShapeFile = {}
+    for origOidFile in origOidFiles:
+        if re.search("^oid-[0-9]+-START.png$", origOidFile):
+            # Green power-on symbol.
+            oidFileNameToShapeFile[origOidFile] = powerOnFile
+        elif re.search("^oid-[0-9]+-STOP.png$", origOidFile):
+            # Stop symbol.
+            oidFileNameToShapeFile[origOidFile] = stopSymbolFile
+        elif options.shape.startswith("box:") or options.shape == "box":
+            # Red box or custom box.            
+            oidFileNameToShapeFile[origOidFile] = None
+        else:
+            # Shape file in "data" dir.
+            oidFileNameToShapeFile[origOidFile] = dataDir + "/" + options.shape
+
+    # Get keys of boxes and labels. They depend on all inputs of the box and label commands.
+    shapeKeys = {None: "box:%d:%d:%d:%s" % (boxInnerWidthPixel, boxInnerHeightPixel, boxBorderWidthPixel, boxBorderColor)}
+    for shapeFile in set(oidFileNameToShapeFile.values()):
+        if shapeFile is not None:
+            shapeKeys[shapeFile] = hashStrings("shape", hashFile(shapeFile), boxTotalWidthPixel, boxTotalHeightPixel)
+    layout = {"boxInnerSize": (boxInnerWidthPixel, boxInnerHeightPixel),
+              "boxTotalSize": (boxTotalWidthPixel, boxTotalHeightPixel),
+              "boxBorderWidth": boxBorderWidthPixel,
+              "boxBorderColor": boxBorderColor,
+              "columnWidth": columnWidthPixel,
+              "textPointSize": textPointSize,
+              "textOffset": boxTotalWidthPixel + textSepPixel,
+              "labelBorderWidth": lineSepPixel / 2,
+              "font": options.font,
+              "compact": options.compact_png,
+              "oidDpi": options.dpi}
+        
+    # Generate label pages.
+    # Generate start/stop labels N times:
+    allOidFiles = (startOidFiles * options.num_start_oid) + (stopOidFiles * options.num_start_oid)
+    if options.num_normal_oid > 1:
+        allOidFiles += sorted((namedOidFiles * options.num_normal_oid) + (numberedOidFiles * options.num_normal_oid))
+    else:
+        allOidFiles += namedOidFiles + numberedOidFiles
+    
+    # Get width of each label and the rows of labels on each page.
+    if options.layout == "pack":
+        # Labels are as wide as their box and text, but not wider than a row.
+        labelWidths = {}
+        for origOidFile in origOidFiles:
+            textWidth = getTextWidth(oidFileNameToName[origOidFile], layout, renderer)
+            labelWidths[origOidFile] = min(layout["textOffset"] + textWidth + textSepPixel, rowWidthPixel - 2 * (lineSepPixel / 2 + 20))
+        pages = packLabels([labelWidths[x] + 2 * (lineSepPixel / 2 + 20) for x in allOidFiles], rowWidthPixel, numRows)
+        pageRows = [[[allOidFiles[i] for i in row] for row in rows] for rows in pages]
+    else:
+        labelWidths = dict([(x, columnWidthPixel) for x in origOidFiles])
+        pageOidFiles = [allOidFiles[i:i + numOidsPerPage] for i in range(0, len(allOidFiles), numOidsPerPage)]
+        pageRows = [[oidFiles[i:i + columns] for i in range(0, len(oidFiles), columns)] for oidFiles in pageOidFiles]
+    
+    if options.output_format != "png":
+        # Vector output: Only the dot pattern of each OID (cropped to the box or masked by the shape) is a bitmap.
+        getDotsSize = lambda origOidFile: layout["boxTotalSize"] if oidFileNameToShapeFile[origOidFile] else layout["boxInnerSize"]
+        dotsKeys = dict([("dots_" + x[:-4] + ".pbm", hashStrings("dots", oidKeys[x], shapeKeys[oidFileNameToShapeFile[x]], renderer)) for x in origOidFiles])
+        def generateDots(dotsFiles):
+            origOidFiles = [x[5:-4] + ".png" for x in dotsFiles]
+            if renderer == "native":
+                runParallel([("Rendering " + oid_dots_dir + "/" + x, renderDotsNative, (getOrigOid(x[5:-4] + ".png"), options.dpi, oid_dots_dir + "/" + x, 
+                              oidFileNameToShapeFile[x[5:-4] + ".png"], getDotsSize(x[5:-4] + ".png"))) for x in dotsFiles])
+                return
+            cachedShapes = {}
+            for shapeFile in set([oidFileNameToShapeFile[x] for x in origOidFiles]) - set([None]):
+                cachedShapes[shapeFile] = getCachedShape(shapeFile, layout["boxTotalSize"], shapeKeys[shapeFile])
+            evictCache([x for fileNames in cachedShapes.values() for x in fileNames])
+            cmds = []
+            for (dotsFile, origOidFile) in zip(dotsFiles, origOidFiles):
+                # Flatten pattern on white, crop it to the box and make it white outside the shape.
+                shapeFile = oidFileNameToShapeFile[origOidFile]
+                crop = "%s -background white -flatten -crop %dx%d+0+0 +repage" % ((oid_orig_dir + "/" + origOidFile,) + getDotsSize(origOidFile))
+                if shapeFile is None:
+                    cmds.append("convert %s -threshold 50%% %s" % (crop, oid_dots_dir + "/" + dotsFile))
+                else:
+                    cmds.append("convert ( %s ) ( %s -negate ) -compose Lighten -composite -threshold 50%% %s" % (crop, cachedShapes[shapeFile][1], oid_dots_dir + "/" + dotsFile))
+            runParallel(cmds)
+        with Phase("boxes"):
+            updateFiles(oid_dots_dir, "dots_oid-*.pbm", readIndex(oid_dots_dir), dotsKeys, generateDots)
+            
+        # Pages have the physical size of the PNG pages, but at least A4, with the labels in the center.
+        layout["dpi"] = int(dpi)
+        layout["columns"] = columns
+        layout["tileBorderWidth"] = 20
+        layout["boxBorderRgb"] = parseColor(boxBorderColor)
+        gridSize = (rowWidthPixel, numRows * (boxTotalHeightPixel + 2 * (lineSepPixel / 2 + 20)))
+        layout["pageSize"] = (max(toPixel(2100), gridSize[0]), max(toPixel(2970), gridSize[1]))
+        layout["pageOffset"] = ((layout["pageSize"][0] - gridSize[0]) / 2, (layout["pageSize"][1] - gridSize[1]) / 2)
+        pages = [[[(oidFileNameToName[x], oid_dots_dir + "/dots_" + x[:-4] + ".pbm", oidFileNameToShapeFile[x], labelWidths[x]) for x in row] for row in rows] 
+                 for rows in pageRows]
+        with Phase("pages"):
+            shapes = dict([(x, layout["boxTotalSize"] + (getShapeRgb(x, layout["boxTotalSize"], shapeKeys[x], oid_dots_dir),)) for x in set(oidFileNameToShapeFile.values()) - set([None])])
+            if options.output_format == "pdf":
+                pageFileNames = [getProjectPath(projectDir, "_oid-table.pdf")]
+                writeOidTablePdf(pages, layout, shapes, pageFileNames[0])
+            else:
+                pageFileNames = [getProjectPath(projectDir, "_oid-table%d.svg" % i) for i in range(len(pages))]
+                runParallel([("Writing " + x, writeOidTableSvg, (y, layout, shapes, x)) for (x, y) in zip(pageFileNames, pages)])
+        return pageFileNames
+    
+    boxKeys = {}
+    labelKeys = {}
+    for origOidFile in origOidFiles:
+        boxKey = hashStrings("box", oidKeys[origOidFile], shapeKeys[oidFileNameToShapeFile[origOidFile]], renderer, options.compact_png)
+        boxKeys["box_" + origOidFile] = boxKey
+        labelKeys["label_" + origOidFile] = hashStrings("label", boxKey, oidFileNameToName[origOidFile], labelWidths[origOidFile], 
+                                                        textPointSize, textSepPixel, lineSepPixel / 2, renderer, options.font, options.compact_png)
+    # ImageMagick already writes PNG files in the smallest lossless color type. For --compact-png compress them best and omit the time stamps.
+    pngArgs = "-define png:compression-level=9 -define png:exclude-chunks=date,time " if options.compact_png else ""
+    
+    boxIndex = readIndex(oid_box_dir)
+    labelIndex = readIndex(oid_label_dir)
+    staleBoxes = getStaleFiles(oid_box_dir, "box_oid-*.png", boxIndex, boxKeys)
+    staleLabels = getStaleFiles(oid_label_dir, "label_oid-*.png", labelIndex, labelKeys)
+    # Boxes and labels are rendered concurrently. The wall time is split among both phases by the time spent on each.
+    phaseSeconds = {}
+    if renderer == "native":
+        # Render box and label of each OID in one pass in memory.
+        tasks = []
+        for origOidFile in sorted(set([x[4:] for x in staleBoxes] + [x[6:] for x in staleLabels])):
+            labelOidFileName = oid_label_dir + "/label_" + origOidFile
+            tasks.append(("Rendering " + labelOidFileName, renderOidNative, 
+                          (getOrigOid(origOidFile), oid_box_dir + "/box_" + origOidFile, labelOidFileName, 
+                           oidFileNameToName[origOidFile], oidFileNameToShapeFile[origOidFile], dict(layout, columnWidth=labelWidths[origOidFile]))))
+        with Phase("boxes", phaseSeconds):
+            phaseSeconds.update(runParallel(tasks))
+    else:
+        # Generate boxes or shapes.
+        # Shapes are resized with -sample, which duplicates/deletes whole rows/columns and does not add new colors. This is desirable as we want to keep the output images with a low number of colors to prevent Word from re-dithering them.
+        def getBoxCommand(boxOidFile, cachedShapes):
+            origOidFileName = oid_orig_dir + "/" + boxOidFile[4:]
+            boxOidFileName = oid_box_dir + "/" + boxOidFile
+            shapeFile = oidFileNameToShapeFile[boxOidFile[4:]]
+            if shapeFile is None:
+                return "convert %s ( -crop %dx%d+0+0 +repage -density 600x600 ) -bordercolor %s -compose Copy -border %d %s%s" % \
+                (origOidFileName, boxInnerWidthPixel, boxInnerHeightPixel, boxBorderColor, boxBorderWidthPixel, pngArgs, boxOidFileName)
+            (shapeFileName, maskFileName) = cachedShapes[shapeFile]
+            return "convert ( -page +0+0 %s -page +0+0 %s -flatten ) %s -alpha Off -compose CopyOpacity -composite %s%s" % \
+            (shapeFileName, origOidFileName, maskFileName, pngArgs, boxOidFileName)
+
+        # Generate labels.
+        def getLabelCommand(labelOidFile):
+            name = oidFileNameToName[labelOidFile[6:]]
+            boxOidFileName = oid_box_dir + "/box_" + labelOidFile[6:]
+            labelOidFileName = oid_label_dir + "/" + labelOidFile
+            return "convert %s ( -extent %dx%d ) ( -gravity West -stroke none %s-pointsize %d -annotate +%d+0 %s ) -bordercolor white -compose Copy -border %d %s%s" % \
+            (boxOidFileName, labelWidths[labelOidFile[6:]], boxTotalHeightPixel, "+antialias " if options.compact_png else "", textPointSize, boxTotalWidthPixel + textSepPixel, name, lineSepPixel / 2, pngArgs, labelOidFileName)
+        
+        # The label command of each OID is chained to its box command, so labels do not wait for all boxes.
+        unchainedLabels = set(staleLabels)
+        cachedShapes = {}
+        for shapeFile in set([oidFileNameToShapeFile[x[4:]] for x in staleBoxes]) - set([None]):
+            cachedShapes[shapeFile] = getCachedShape(shapeFile, (boxTotalWidthPixel, boxTotalHeightPixel), shapeKeys[shapeFile])
+        evictCache([x for fileNames in cachedShapes.values() for x in fileNames])
+        chains = []
+        for boxOidFile in staleBoxes:
+            labelOidFile = "label_" + boxOidFile[4:]
+            chains.append([("boxes", getBoxCommand(boxOidFile, cachedShapes))] + ([("labels", getLabelCommand(labelOidFile))] if labelOidFile in unchainedLabels else []))
+            unchainedLabels.discard(labelOidFile)
+        chains += [[("labels", getLabelCommand(x))] for x in sorted(unchainedLabels)]
+        with Phase("boxes", phaseSeconds):
+            phaseSeconds.update(runParallel(chains))
+    finishFiles(oid_box_dir, boxIndex, boxKeys, staleBoxes)
+    finishFiles(oid_label_dir, labelIndex, labelKeys, staleLabels)
+            
+    pages = []
+    tasks = []
+    for (i, rows) in enumerate(pageRows):
+        labelRows = [[oid_label_dir + "/label_" + x for x in row] for row in rows]
+        pageFileName = getProjectPath(projectDir, "_oid-table%d.png" % i)
+        if renderer == "native":
+            tasks.append(("Composing " + pageFileName, composePageNative, (labelRows, rowWidthPixel, int(dpi), pageFileName, options.compact_png)))
+        elif options.layout == "pack":
+            # Append the framed labels of each row horizontally and the rows vertically, padded with white to the row width.
+            tasks.append("convert -bordercolor '#dfdfdf' -background white %s -append -gravity NorthWest -extent %dx%d %s%s" % 
+                         (" ".join(["( %s -border 20 +append )" % " ".join(x) for x in labelRows]), rowWidthPixel, 
+                          len(labelRows) * (labelTotalHeightPixel + 2 * 20), pngArgs, pageFileName))
+        else:
+            tasks.append("montage -border 20 %s -mode Concatenate -tile %dx %s%s" % (" ".join(sum(labelRows, [])), columns, pngArgs, pageFileName))
+        pages.append(pageFileName)
+    with Phase("pages"):
+        runParallel(tasks)
+    return pages
+
+
+def getOidTableKey(usedScriptNames, startOid, codesYamlFileName, tttool):
+    """Return key over all inputs of buildOidTable(). The OID table only needs to be rebuilt when this key changes.
+    """
+    shapeFile = dataDir + "/" + options.shape
+    shapeKey = hashFile(shapeFile) if os.path.isfile(shapeFile) else ""
+    return hashStrings(version, getToolSignature(tttool), startOid, sorted(usedScriptNames), 
+                       hashFile(codesYamlFileName), options.num_start_oid, options.num_normal_oid, options.num_columns, options.layout,
+                       options.num_additional_oids, options.dpi, options.shape, shapeKey, getRenderer(), options.font, options.output_format, options.compact_png, options.oid_generator)
+
+
+def findProjectDirs(root):
+    """Return sorted list of all project directories below root.
+    
+    Project directories are named pNNN_* and contain a _welcome.ogg file.
+    """
+    projectDirs = []
+    for (dirPath, dirNames, fileNames) in os.walk(root):
+        if getProductIdFromDirName(os.path.basename(dirPath)) is not None and "_welcome.ogg" in fileNames:
+            projectDirs.append(dirPath)
+            del dirNames[:]
+    return sorted(projectDirs)
+    
+    
+def getProjectProductId(projectDir):
+    """Return product id of a project directory: From its *.yaml file if it exists, else from its name.
+    """
+    yamlList = [x for x in glob.glob(projectDir + "/*.yaml") if not x.endswith(".codes.yaml")]
+    productId = getProductIdFromDirName(os.path.basename(projectDir))
+    if len(yamlList) == 1:
+        return getYamlProductId(yamlList[0], productId)
+    return productId
+
+
+def removeOption(args, shortOpt, longOpt):
+    """Remove option with argument (e.g. -j 4, -j4, --jobs 4 or --jobs=4) from list of command line args.
+    """
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in (shortOpt, longOpt):
+            skip = True
+        elif not (arg.startswith(shortOpt) and not arg.startswith("--")) and not arg.startswith(longOpt + "="):
+            result.append(arg)
+    return result
+    
+    
+batchLogFileName = "ogg2gme.log"
+
+
+def buildProject(projectDir, args):
+    """Build one project of a batch in a child process. Return (exitStatus, seconds).
+    """
+    log = open(projectDir + "/" + batchLogFileName, "wb")
+    try:
+        startTime = time.time()
+        status = subprocess.call([sys.executable, os.path.realpath(__file__)] + args, cwd=projectDir, stdout=log, stderr=subprocess.STDOUT)
+        return (status, time.time() - startTime)
+    finally:
+        log.close()
+
+
+def getBatchOutputs(projectDir):
+    """Return the names of the *.gme file and the OID table pages (PNG, PDF or SVG) of a project built by buildProject().
+    
+    The pages are the ones buildOidTable() returned, as recorded in the build manifest.
+    """
+    yamlFileName = getYamlFileNames(projectDir)[0]
+    outputs = [x for x in [yamlFileName[:-5] + ".gme"] if os.path.exists(x)]
+    if options.build_oid_table:
+        outputs += readManifest(getManifestFileName(yamlFileName)).get("oid-table", {}).get("pages", [])
+    return [os.path.basename(x) for x in outputs]
+
+
+def buildBatch(root):
+    """Build all projects below root in parallel (--batch) and print a summary.
+    
+    Each project is built by a child process, with all command line options
+    except --batch and --jobs, and logs into ogg2gme.log in its directory.
+    """
+    if options.product_id:
+        raise Error("--product-id cannot be used with --batch.")
+    if options.watch:
+        raise Error("--watch cannot be used with --batch.")
+    if options.serve:
+        raise Error("--serve cannot be used with --batch.")
+    projectDirs = findProjectDirs(root)
+    if not projectDirs:
+        raise Error("Did not find any project directories (pNNN_* with a _welcome.ogg file) in %s." % root)
+    
+    # All projects must have different product ids to be on the pen at the same time.
+    productIdToDirs = {}
+    for projectDir in projectDirs:
+        productIdToDirs.setdefault(getProjectProductId(projectDir), []).append(projectDir)
+    duplicates = ["%d (%s)" % (x, ", ".join(productIdToDirs[x])) for x in sorted(productIdToDirs) if len(productIdToDirs[x]) > 1]
+    if duplicates:
+        raise Error("Duplicate product-ids: " + "; ".join(duplicates))
+        
+    args = removeOption(removeOption(sys.argv[1:], "-B", "--batch"), "-j", "--jobs") + ["--jobs", "1"]
+    if options.verbose:
+        print "Building %d projects, %d in parallel" % (len(projectDirs), options.jobs)
+    startTime = time.time()
+    pool = ThreadPool(max(1, min(options.jobs, len(projectDirs))))
+    try:
+        results = pool.imap(lambda x: buildProject(x, args), projectDirs)
+        # Waiting with a timeout keeps Ctrl-C working in Python 2.
+        results = [results.next(999999) for x in projectDirs]
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        
+    # Print summary.
+    numFailed = 0
+    print "%-30s %5s %-6s %8s  %s" % ("Project", "PID", "Status", "Time", "Outputs")
+    for (projectDir, (status, seconds)) in zip(projectDirs, results):
+        if status:
+            numFailed += 1
+            outputs = ["see " + projectDir + "/" + batchLogFileName]
+        else:
+            outputs = getBatchOutputs(projectDir)
+        print "%-30s %5d %-6s %7.1fs  %s" % (os.path.basename(projectDir), getProjectProductId(projectDir), "FAILED" if status else "ok", seconds, " ".join(outputs))
+    print "%d projects, %d failed, %.1fs" % (len(projectDirs), numFailed, time.time() - startTime)
+    if numFailed:
+        raise Error("%d of %d projects failed." % (numFailed, len(projectDirs)))
+        
+
+def useConfig(config):
+    """Use config (see BuildConfig) as the options of the builds in the current thread.
+    """
+    options.__dict__.clear()
+    options.__dict__.update(config.__dict__)
+    if not options.tttool:
+        options.tttool = "tttool" if not isWindows() else "tttool.exe"
+    if options.trace:
+        options.profile = True
+    options.cache_dir = os.path.abspath(os.path.expanduser(options.cache_dir or getDefaultCacheDir()))
+    
+    
+class BuildConfig:
+    """Options of a build. See Project.
+    
+    The attributes are named like the long command line options (e.g. build_oid_table
+    for --build-oid-table) and default to the same values. Keyword arguments override
+    them, e.g. BuildConfig(build_oid_table=True, shape="stern_gelb.gif").
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(createOptionParser().defaults)
+        for (name, value) in kwargs.items():
+            if name not in self.__dict__:
+                raise Error("Unknown build option '%s'." % name)
+            setattr(self, name, value)
+            
+            
+class BuildResult:
+    """Result of Project.build().
+    
+    Attributes: projectDir, yamlFileName, codesYamlFileName, gmeFileName, pages (the
+    OID table PNG files, empty without build_oid_table), gmeBuilt and oidTableBuilt
+    (False if they were up to date), phaseTimes (seconds per phase), seconds (total)
+    and profile (the records of --profile, if enabled).
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        
+        
+class Project:
+    """Project directory with *.ogg files (including _welcome.ogg) and optionally a *.yaml file.
+    
+    Usage: result = Project("p901_my_book", BuildConfig(build_oid_table=True)).build()
+    
+    Builds never change the current directory of the process and use the
+    options of their own BuildConfig, so several threads can build projects
+    concurrently (each project by one thread at a time).
+    """
+    def __init__(self, projectDir, config=None):
+        self.projectDir = projectDir
+        self.config = config or BuildConfig()
+        
+    def build(self):
+        """Build the *.gme file and (with build_oid_table) the OID table. Return BuildResult.
+        
+        Raise Error on failure.
+        """
+        useConfig(self.config)
+        buildState.reset()
+        projectDir = self.projectDir
+        if not os.path.exists(getProjectPath(projectDir, "_welcome.ogg")):
+            raise Error("Did not find a '_welcome.ogg' file in %s. Please create one." % projectDir)
+        
+        # Find tttool in parent dirs or PATH.
+        tttool = findFileInParentDirs(options.tttool, options.tttool, projectDir)
+        
+        (yamlFileName, codesYamlFileName) = getYamlFileNames(projectDir)
+        productId = getProductId(projectDir)
+        with Phase("yaml"):
+            (usedScriptNames, yamlHead, yamlTail) = readOrGenerateYaml(yamlFileName, productId)
+        if options.transcode:
+            with Phase("transcode"):
+                transcodeAudioFiles(projectDir)
+        manifestFileName = getManifestFileName(yamlFileName)
+        manifest = readManifest(manifestFileName)
+        with Phase("yaml"):
+            audioFileList = getListOfAudioFiles(projectDir)
+            # The YAML file is parsed only once per build. Its scripts and product-id are passed to the OID table.
+            usedScriptNames = appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yamlHead, yamlTail)
+            startOid = getYamlProductId(yamlFileName, productId)
+            if options.dedup_audio or "# dedup" in readStringFromFile(yamlFileName):
+                dedupAudio(yamlFileName, audioFileList, manifest)
+        
+        # Build *.gme file unless all inputs and the *.gme file are unchanged since the last build.
+        gmeFileName = yamlFileName[:-5] + ".gme"
+        gmeFiles = [yamlFileName, codesYamlFileName, gmeFileName] + audioFileList
+        gmeKey = hashStrings(getToolSignature(tttool))
+        outputs = {"gmeBuilt": False, "oidTableBuilt": False, "pages": []}
+        # The steps run concurrently (see Scheduler) and both update the manifest.
+        manifestLock = threading.Lock()
+        def assemble():
+            gme = manifest.get("gme", {})
+            if not options.force and gme.get("key") == gmeKey and areFilesUnchanged(gme.get("files", {}), gmeFiles):
+                if options.verbose:
+                    print "%s is up to date" % gmeFileName
+                return
+            # Files saved while tttool reads them must count as changed in the next build, so take their states (and
+            # the hashes of the audio files) before. The *.gme and *.codes.yaml files are written by the build itself.
+            states = getFileStates([yamlFileName] + audioFileList)
+            # If only audio files changed, replace them in the *.gme file.
+            changedFiles = getChangedFiles(gme.get("files", {}), gmeFiles) if not options.force and gme.get("key") == gmeKey and gme.get("media") else None
+            patched = False
+            if changedFiles is not None and set(changedFiles).issubset(audioFileList):
+                with Phase("patch"):
+                    patched = patchGme(gmeFileName, [[getProjectPath(projectDir, x) for x in names] for names in gme["media"]], changedFiles)
+            if patched and options.verify_patch:
+                verifyGme(yamlFileName, gmeFileName, tttool)
+            if not patched:
+                with Phase("assemble"):
+                    audioHashes = getAudioHashes(audioFileList, manifest)
+                    buildGme(yamlFileName, tttool)
+                    media = getGmeMediaFiles(gmeFileName, audioHashes)
+            states.update(getFileStates([codesYamlFileName, gmeFileName]))
+            with manifestLock:
+                manifest["gme"] = {"key": gmeKey, "files": states, "media": gme["media"] if patched else media}
+                writeManifest(manifestFileName, manifest)
+            outputs["gmeBuilt"] = True
+        
+        # Build OID table unless the codes and the layout are unchanged since the last build.
+        def buildTable(codesYamlFileName=codesYamlFileName):
+            oidTableKey = getOidTableKey(usedScriptNames, startOid, codesYamlFileName, tttool)
+            oidTable = manifest.get("oid-table", {})
+            if not options.force and oidTable.get("key") == oidTableKey and all([os.path.exists(x) for x in oidTable.get("pages", [])]):
+                if options.verbose:
+                    print "OID table %s is up to date" % " ".join(oidTable["pages"])
+                outputs["pages"] = oidTable["pages"]
+                return
+            outputs["pages"] = buildOidTable(projectDir, usedScriptNames, startOid, codesYamlFileName, tttool)
+            with manifestLock:
+                manifest["oid-table"] = {"key": oidTableKey, "pages": outputs["pages"]}
+                writeManifest(manifestFileName, manifest)
+            outputs["oidTableBuilt"] = True
+            
+        # tttool assemble assigns codes to new scripts. Only then the OID table has to wait for it.
+        scheduler = Scheduler()
+        scheduler.add("assemble", assemble)
+        snapshotFileName = None
+        if options.build_oid_table:
+            hasAllCodes = os.path.exists(codesYamlFileName) and set(usedScriptNames).issubset(readCodesYaml(codesYamlFileName))
+            if hasAllCodes:
+                # tttool assemble may rewrite the *.codes.yaml file meanwhile. Build the OID table from a copy.
+                (fd, snapshotFileName) = tempfile.mkstemp(".codes.yaml", ".snapshot-", os.path.dirname(codesYamlFileName) or ".")
+                os.close(fd)
+                shutil.copyfile(codesYamlFileName, snapshotFileName)
+                scheduler.add("oid-table", lambda: buildTable(snapshotFileName))
+            else:
+                scheduler.add("oid-table", buildTable, ["assemble"])
+        try:
+            scheduler.run()
+        finally:
+            if snapshotFileName:
+                os.remove(snapshotFileName)
+        if options.build_oid_table and hasAllCodes and manifest.get("oid-table", {}).get("key") != getOidTableKey(usedScriptNames, startOid, codesYamlFileName, tttool):
+            # tttool changed the codes while the OID table was built from them.
+            buildTable()
+                
+        return BuildResult(projectDir=projectDir, yamlFileName=yamlFileName, codesYamlFileName=codesYamlFileName, gmeFileName=gmeFileName, 
+                           pages=outputs["pages"], gmeBuilt=outputs["gmeBuilt"], oidTableBuilt=outputs["oidTableBuilt"],
+                           phaseTimes=dict(buildState.phaseTimes),
+                           seconds=time.time() - buildState.startTime, profile=list(buildState.profile))
+
+
+# Files which trigger a rebuild in --watch mode (in addition to audioSourcePatterns for --transcode).
+watchPatterns = ["*.ogg", "*.yaml"]
+
+# --watch rebuilds once no further change arrived for this many seconds.
+watchQuietTime = 0.25
+
+# inotify(7) events which wake up --watch.
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+
+
+def openInotify(dirName):
+    """Return an inotify file descriptor which watches dirName for written, moved and deleted files.
+    
+    Return None if inotify is not available (e.g. on Windows and Mac OS X).
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, dirName, IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def waitForEvent(fd, timeout):
+    """Wait until inotify fd has events (and discard them) or timeout seconds passed. Return True on events.
+    
+    timeout None waits forever. Without inotify (fd None) just sleep for one second.
+    """
+    if fd is None:
+        time.sleep(1.0)
+        return True
+    if not select.select([fd], [], [], timeout)[0]:
+        return False
+    os.read(fd, 65536)
+    return True
+
+
+def getWatchedFiles(projectDir):
+    """Return list of files in projectDir which trigger a rebuild in --watch mode.
+    """
+    patterns = watchPatterns + (audioSourcePatterns if options.transcode else [])
+    return sorted([x for pattern in patterns for x in glob.glob(getProjectPath(projectDir, pattern))])
+
+
+def watch(project):
+    """Build project now and whenever its *.ogg or *.yaml files change (--watch).
+    
+    Changes are detected with inotify on Linux, elsewhere by checking the files
+    every second. A burst of changes (e.g. exporting several recordings) causes
+    only one rebuild, as soon as no further change arrived for watchQuietTime
+    seconds. Files which were touched but did not change (see --checksum) and
+    files written by the build itself do not cause a rebuild. Changes made while
+    a build runs cause a rebuild as soon as it finished.
+    """
+    projectDir = project.projectDir
+    fd = openInotify(projectDir)
+    if fd is None:
+        print "Warning: inotify is not available. Checking for changes every second."
+    try:
+        while True:
+            # Files which change while the build runs are compared with their states from before the build.
+            states = getFileStates(getWatchedFiles(projectDir))
+            try:
+                result = project.build()
+                print "Build finished in %.1fs. Waiting for changes (Ctrl-C to stop)" % result.seconds
+            except Error as e:
+                print "Error:", e.message
+                print "Waiting for changes (Ctrl-C to stop)"
+            if options.profile:
+                printProfile()
+                if options.trace:
+                    writeTrace(options.trace)
+            sys.stdout.flush()
+            for (fileName, state) in buildState.writtenFiles.items():
+                if state is None:
+                    states.pop(fileName, None)
+                else:
+                    states[fileName] = state
+            while areFilesUnchanged(states, getWatchedFiles(projectDir)):
+                waitForEvent(fd, None)
+            # Wait until no further change arrives for watchQuietTime seconds.
+            if fd is not None:
+                while waitForEvent(fd, watchQuietTime):
+                    pass
+            else:
+                states = None
+                while states is None or not areFilesUnchanged(states, getWatchedFiles(projectDir)):
+                    states = getFileStates(getWatchedFiles(projectDir))
+                    time.sleep(watchQuietTime)
+            if options.verbose:
+                print "Files changed, rebuilding"
+    except KeyboardInterrupt:
+        print
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+# Build options which clients of --serve may set with query parameters (e.g. POST /jobs?shape=stern_gelb.gif).
+# Also listed in the docstring of BuildRequestHandler and in README.md.
+serveBuildOptions = ["build_oid_table", "num_start_oid", "num_normal_oid", "num_columns", "layout", "num_additional_oids", "dpi", "product_id",
+                     "shape", "renderer", "oid_generator", "output_format", "compact_png", "dedup_audio", "transcode", "encoder", "audio_quality"]
+
+# Files which are extracted from uploaded project archives.
+serveUploadPatterns = ["*.ogg", "*.yaml"] + audioSourcePatterns
+
+# Content types of the result files of --serve.
+serveContentTypes = {".png": "image/png", ".pdf": "application/pdf", ".svg": "image/svg+xml"}
+
+# --serve keeps the files of at most this many finished jobs. Older jobs are removed.
+serveMaxFinishedJobs = 100
+
+
+class BuildJob:
+    """A project uploaded to the build service (--serve).
+    """
+    def __init__(self, jobId, projectDir, config):
+        self.jobId = jobId
+        self.projectDir = projectDir
+        self.config = config
+        self.state = "queued"
+        self.error = None
+        self.result = None
+        self.queuedTime = time.time()
+        self.startTime = None
+        self.endTime = None
+        self.done = threading.Event()
+        
+    def getStatus(self):
+        """Return status of the job as dict (for JSON).
+        """
+        status = {"id": self.jobId, "state": self.state, "error": self.error, "queued": self.queuedTime, "started": self.startTime, "finished": self.endTime}
+        if self.startTime:
+            status["waitSeconds"] = self.startTime - self.queuedTime
+        if self.result:
+            status["buildSeconds"] = self.result.seconds
+            status["phaseTimes"] = self.result.phaseTimes
+            status["files"] = [os.path.basename(x) for x in [self.result.gmeFileName] + self.result.pages]
+        return status
+        
+
+class BuildService:
+    """Queue of build jobs, built by a pool of worker threads in this process (--serve).
+    """
+    def __init__(self, numWorkers, maxQueued, workDir, config):
+        self.numWorkers = numWorkers
+        self.workDir = workDir
+        self.config = config
+        self.queue = Queue.Queue(maxQueued)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.nextJobId = 1
+        for i in range(numWorkers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            
+    def submit(self, archiveFileName, params):
+        """Unpack project archive (zip or tar) and queue it for building. Return BuildJob.
+        
+        params maps names of serveBuildOptions to strings, which override the
+        options of the service. Raise Error for invalid archives or params and
+        when the queue is full.
+        """
+        config = BuildConfig(**self.config.__dict__)
+        parser = createOptionParser()
+        for (name, value) in params.items():
+            option = [x for x in parser.option_list if x.dest == name]
+            if name not in serveBuildOptions or not option:
+                raise Error("Unknown parameter '%s'." % name)
+            option = option[0]
+            if option.action == "store_true":
+                value = value.lower() in ("1", "true", "yes")
+            elif option.type == "int":
+                value = castTo(value, int, None)
+                if value is None:
+                    raise Error("Parameter '%s' must be an integer." % name)
+            elif option.type == "choice" and value not in option.choices:
+                raise Error("Parameter '%s' must be one of %s." % (name, ", ".join(option.choices)))
+            setattr(config, name, value)
+        checkAudioQuality(config.audio_quality)
+        # The border color of box:... shapes is part of the ImageMagick commands.
+        if config.shape.startswith("box") and not re.match(r"box(:[0-9]+(:[0-9]+(:[0-9]+(:#?[A-Za-z0-9]+)?)?)?)?$", config.shape):
+            raise Error("Invalid shape '%s'. Must be box:WIDTH:HEIGHT:BORDER_THICKNESS:BORDER_COLOR." % config.shape)
+        if not config.shape.startswith("box") and not os.path.isfile(dataDir + "/" + os.path.basename(config.shape)):
+            raise Error("Unknown shape '%s'." % config.shape)
+        config.shape = config.shape if config.shape.startswith("box") else os.path.basename(config.shape)
+        
+        with self.lock:
+            jobId = self.nextJobId
+            self.nextJobId += 1
+        jobDir = self.workDir + "/" + str(jobId)
+        os.mkdir(jobDir)
+        try:
+            projectDir = jobDir + "/" + self.unpack(archiveFileName, jobDir, config.product_id, jobId)
+            job = BuildJob(jobId, projectDir, config)
+            with self.lock:
+                self.queue.put_nowait(job)
+                self.jobs[jobId] = job
+        except Queue.Full:
+            shutil.rmtree(jobDir)
+            raise Error("Too many queued jobs. Please retry later.")
+        except:
+            shutil.rmtree(jobDir)
+            raise
+        return job
+        
+    def unpack(self, archiveFileName, jobDir, productId, jobId):
+        """Extract *.ogg and *.yaml files (without their directories) from archive into a new project directory in jobDir.
+        
+        Return the name of the project directory (see extract()). Raise Error for
+        invalid, corrupt or truncated archives.
+        """
+        try:
+            return self.extract(archiveFileName, jobDir, productId, jobId)
+        except (zipfile.BadZipfile, tarfile.TarError, IOError, EOFError, zlib.error) as e:
+            raise Error("Invalid archive: %s" % e)
+            
+    def extract(self, archiveFileName, jobDir, productId, jobId):
+        """Extract the project files of archive like unpack(), but let the errors of zipfile and tarfile pass.
+        
+        Return the name of the project directory: The top level directory of the
+        archive if it is named pNNN_*, else derived from productId or the product-id
+        of the *.yaml file.
+        """
+        if zipfile.is_zipfile(archiveFileName):
+            archive = zipfile.ZipFile(archiveFileName)
+            members = [(x.filename, x.filename.endswith("/"), archive.open) for x in archive.infolist()]
+        else:
+            try:
+                archive = tarfile.open(archiveFileName)
+            except tarfile.TarError:
+                raise Error("Expecting a zip or tar archive.")
+            members = [(x.name, not x.isfile(), lambda name: archive.extractfile(name)) for x in archive.getmembers()]
+        topDirs = set([x[0].strip("/").split("/")[0] for x in members if "/" in x[0].strip("/")])
+        fileNames = {}
+        for (name, isDir, openMember) in members:
+            baseName = os.path.basename(name)
+            if not isDir and not baseName.startswith(".") and any([fnmatch.fnmatch(baseName, x) for x in serveUploadPatterns]):
+                if baseName in fileNames:
+                    raise Error("Archive contains more than one %s." % baseName)
+                fileNames[baseName] = (name, openMember)
+        if "_welcome.ogg" not in fileNames:
+            raise Error("Archive does not contain a _welcome.ogg file.")
+        
+        if len(topDirs) == 1 and getProductIdFromDirName(list(topDirs)[0]) is not None:
+            projectName = list(topDirs)[0]
+        else:
+            if not productId:
+                yamlFiles = [x for x in fileNames if x.endswith(".yaml") and not x.endswith(".codes.yaml")]
+                if yamlFiles:
+                    match = re.search("^product-id: *([0-9]+)", fileNames[yamlFiles[0]][1](fileNames[yamlFiles[0]][0]).read(), re.MULTILINE)
+                    productId = int(match.group(1)) if match else 0
+            if not productId:
+                raise Error("Unable to determine product-id. Either use a top level directory p<PRODUCTID>_* in the archive, a *.yaml file or the product_id parameter.")
+            projectName = "p%d_job%d" % (productId, jobId)
+        projectDir = jobDir + "/" + projectName
+        os.mkdir(projectDir)
+        for (baseName, (name, openMember)) in fileNames.items():
+            src = openMember(name)
+            dst = open(projectDir + "/" + baseName, "wb")
+            shutil.copyfileobj(src, dst)
+            dst.close()
+            src.close()
+        return projectName
+        
+    def work(self):
+        """Worker thread: Build queued jobs.
+        """
+        while True:
+            job = self.queue.get()
+            job.state = "running"
+            job.startTime = time.time()
+            try:
+                job.result = Project(job.projectDir, job.config).build()
+                job.state = "done"
+            except Error as e:
+                job.error = e.message
+                job.state = "failed"
+            except Exception as e:
+                job.error = "%s: %s" % (e.__class__.__name__, e)
+                job.state = "failed"
+            job.endTime = time.time()
+            job.done.set()
+            self.removeOldJobs()
+            
+    def removeOldJobs(self):
+        """Remove the oldest finished jobs and their files if there are more than serveMaxFinishedJobs.
+        """
+        with self.lock:
+            finished = sorted([x for x in self.jobs.values() if x.done.is_set()], key=lambda x: x.endTime)
+            for job in finished[:max(0, len(finished) - serveMaxFinishedJobs)]:
+                self.removeJob(job)
+                
+    def removeJob(self, job):
+        """Forget a finished job and remove its files. The caller must hold the lock.
+        """
+        del self.jobs[job.jobId]
+        shutil.rmtree(self.workDir + "/" + str(job.jobId), True)
+            
+    def getStatus(self):
+        """Return status of the service as dict (for JSON).
+        """
+        with self.lock:
+            jobs = self.jobs.values()
+        states = [x.state for x in jobs]
+        finished = [x for x in jobs if x.state in ("done", "failed")]
+        status = {"workers": self.numWorkers, "queueDepth": states.count("queued"), "maxQueued": self.queue.maxsize,
+                  "running": states.count("running"), "done": states.count("done"), "failed": states.count("failed")}
+        if finished:
+            status["meanWaitSeconds"] = sum([x.startTime - x.queuedTime for x in finished]) / len(finished)
+            status["meanBuildSeconds"] = sum([x.endTime - x.startTime for x in finished]) / len(finished)
+        return status
+        
+        
+class BuildRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP interface of the build service (--serve):
+    
+    POST /jobs[?PARAM=VALUE...]     Upload project archive (zip or tar) and queue it. Returns the job status.
+    GET /jobs/ID[?wait=SECONDS]     Job status (optionally wait until it is finished), including timings and files.
+    GET /jobs/ID/FILE               Download result file: *.gme, _oid-table*.png, _oid-table.pdf or _oid-table*.svg
+                                    (see files in the job status).
+    DELETE /jobs/ID                 Remove a finished job.
+    GET /status                     Queue depth, number of running/done/failed jobs and mean timings.
+    
+    The PARAMs of POST /jobs are the build options of serveBuildOptions, named
+    like the long command line options: build_oid_table (default 1), product_id,
+    shape, dpi, num_columns, layout, num_start_oid, num_normal_oid,
+    num_additional_oids, renderer, oid_generator, output_format, compact_png,
+    dedup_audio, transcode, encoder and audio_quality. Flags are 1, true or yes.
+    """
+    server_version = "ogg2gme/" + version
+    
+    def sendJson(self, code, data):
+        """Send JSON response.
+        """
+        body = json.dumps(data, indent=1, sort_keys=True) + "\n"
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def getJob(self, path):
+        """Return job with the id in path (/jobs/ID/...) or None after sending 404.
+        """
+        fields = path.split("/")
+        with self.server.service.lock:
+            job = self.server.service.jobs.get(castTo(fields[2], int, 0)) if len(fields) > 2 else None
+        if not job:
+            self.sendJson(404, {"error": "No such job."})
+        return job
+        
+    def do_POST(self):
+        (path, query) = urllib.splitquery(self.path)
+        if path != "/jobs":
+            return self.sendJson(404, {"error": "Not found."})
+        length = castTo(self.headers.getheader("Content-Length"), int, -1)
+        if length < 0:
+            return self.sendJson(411, {"error": "Content-Length required."})
+        (fd, archiveFileName) = tempfile.mkstemp(prefix="upload-", dir=self.server.service.workDir)
+        try:
+            f = os.fdopen(fd, "wb")
+            while length > 0:
+                data = self.rfile.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                f.write(data)
+                length -= len(data)
+            f.close()
+            params = dict(urlparse.parse_qsl(query or ""))
+            job = self.server.service.submit(archiveFileName, params)
+        except Error as e:
+            return self.sendJson(503 if "Too many" in e.message else 400, {"error": e.message})
+        finally:
+            os.remove(archiveFileName)
+        self.sendJson(202, job.getStatus())
+        
+    def do_GET(self):
+        (path, query) = urllib.splitquery(self.path)
+        if path == "/status":
+            return self.sendJson(200, self.server.service.getStatus())
+        if not path.startswith("/jobs/"):
+            return self.sendJson(404, {"error": "Not found."})
+        job = self.getJob(path)
+        if not job:
+            return
+        fields = path.split("/")
+        if len(fields) == 3:
+            wait = castTo(dict(urlparse.parse_qsl(query or "")).get("wait"), float, 0)
+            if wait > 0:
+                job.done.wait(wait)
+            return self.sendJson(200, job.getStatus())
+        status = job.getStatus()
+        if len(fields) != 4 or fields[3] not in status.get("files", []):
+            return self.sendJson(404, {"error": "No such file."})
+        fileName = job.projectDir + "/" + fields[3]
+        self.send_response(200)
+        self.send_header("Content-Type", serveContentTypes.get(os.path.splitext(fileName)[1], "application/octet-stream"))
+        self.send_header("Content-Length", str(os.path.getsize(fileName)))
+        self.end_headers()
+        f = open(fileName, "rb")
+        shutil.copyfileobj(f, self.wfile)
+        f.close()
+        
+    def do_DELETE(self):
+        job = self.getJob(urllib.splitquery(self.path)[0])
+        if not job:
+            return
+        if not job.done.is_set():
+            return self.sendJson(409, {"error": "Job is not finished."})
+        with self.server.service.lock:
+            self.server.service.removeJob(job)
+        self.sendJson(200, {"id": job.jobId, "state": "removed"})
+        
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+            
+            
+class BuildServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server which handles each request in its own thread.
+    """
+    daemon_threads = True
+    
+    
+def serve(port):
+    """Run the build service (--serve) on localhost:port until Ctrl-C is pressed.
+    
+    Uploaded projects are built by --jobs worker threads in this process, each
+    with one job at a time, using the options of the service (with -t).
+    """
+    tttool = findFileInParentDirs(options.tttool, options.tttool, ".")
+    config = BuildConfig(**dict(options.__dict__, build_oid_table=True, jobs=1, tttool=tttool, serve=0, profile=False, trace=""))
+    workDir = tempfile.mkdtemp(prefix="ogg2gme-serve-")
+    try:
+        server = BuildServer(("127.0.0.1", port), BuildRequestHandler)
+        server.verbose = options.verbose
+        server.service = BuildService(max(1, options.jobs), options.serve_queue, workDir, config)
+        print "Serving on http://127.0.0.1:%d/ with %d workers (Ctrl-C to stop)" % (server.server_address[1], server.service.numWorkers)
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print
+    finally:
+        shutil.rmtree(workDir, True)
+
+
+def createOptionParser():
+    """Return the parser of the command line options. Its defaults are the defaults of BuildConfig.
+    """
+    usage = """Usage: %prog [options]
+
+Convert all *.ogg files found in the current directory into a Tip-Toi *.gme file and
+optionally (-t) a _oid-table0.png file which contains the OID labels.
+
+This tool is useful when generating simple OID labels, each associated with one sample.
+Examples: 
+    - Adding Tip-Toi support to non-Tip-Toi books.
+    - Audio CDs.
+
+The generated *.yaml file can be edited at any time and is not overwritten by this tool.
+This tool always adds samples to the *.yaml file which are not yet in the *.yaml file.
+
+This tool requires:
+    - tttool (must be in ../tttool)
+    - convert/montage (from ImageMagick, must be on the PATH)
+"""
+    parser = optparse.OptionParser(usage=usage, version=version)
+    parser.add_option("-t", "--build-oid-table",  default=False, action="store_true", help="Generate PNG file(s) which contain(s) all oids for this product.")
+    parser.add_option("-S", "--num-start-oid",  default=3, type="int", help="For -t/--build-oid-table: Generate N START and N STOP OIDs (e.g. to re-use the same product id for multiple projects). Default is 3.")
     parser.add_option("-M", "--num-normal-oid",  default=1, type="int", help="For -t/--build-oid-table: Generate each normal OID N times. Default is 1.")
     parser.add_option("-C", "--num-columns",  default=3, type="int", help="For -t/--build-oid-table: Arrange OID labels in N columns on each page. Default is 3.")
+    parser.add_option("-L", "--layout",  type="choice", choices=["grid", "pack"], default="grid", help="For -t/--build-oid-table: Place the OID labels in a grid of --num-columns equally wide columns, or pack them (each as wide as its box and text) into as few pages as possible. pack does not fill up the last page with additional OIDs. Default is grid.")
     parser.add_option("-N", "--num-additional-oids",  default=10, type="int", help="For -t/--build-oid-table: This tool always fills whole pages with additional OIDs (additional to the OIDs for the named OIDs from the *.yaml file). This parameter sets the minimum amount of additional OIDs. Default is 10.")
-    parser.add_option("-d", "--dpi",  default="600d", type="string", help="For -t/--build-oid-table: DPI setting for tttool, used to generate the OIDs. Must be either 600, 600d, 1200 or 1200d. The d variants double the pixel size. Default is 600d.")
+    parser.add_option("-d", "--dpi",  default="600d", type="choice", choices=["600", "600d", "1200", "1200d"], help="For -t/--build-oid-table: DPI setting for tttool, used to generate the OIDs. Must be either 600, 600d, 1200 or 1200d. The d variants double the pixel size. Default is 600d.")
     parser.add_option("-p", "--product-id",  type=int, default=0, help="Set product-id. This only has an effect when generating the *.yaml file for the first time. Once the *.yaml file exists please edit the product-id in the *.yaml file directly.")
     parser.add_option("-s", "--shape",  type=str, default="box", help="Set shape for oid images: Must be either box (default) or box:WIDTH:HEIGHT:BORDER_THICKNESS:BORDER_COLOR or one of the files in 'data' (anleitung_gelb.gif play_gelb.gif stern_gelb.gif stern_orange.gif).")    
     parser.add_option("-T", "--tttool",  type=str, default="", help="Set name of the tttool executable. Default is tttool.exe on Windows and tttool on all other oses. The executable is always searched in the parent dirs.")
+    parser.add_option("-j", "--jobs",  type=int, default=getNumCpus(), help="Run up to N ImageMagick or encoder commands (or with --batch: N projects) in parallel. With -t tttool assemble also runs concurrently to the OID table unless N is 1. Default is the number of CPU cores (%default).")
+    parser.add_option("-R", "--renderer",  type="choice", choices=["auto", "native", "imagemagick"], default="auto", help="For -t/--build-oid-table: Render boxes and labels either with ImageMagick (convert) or natively in Python using Pillow, which is much faster. auto (default) uses native if Pillow is installed.")
+    parser.add_option("--oid-generator",  type="choice", choices=["auto", "native", "tttool"], default="auto", help="For -t/--build-oid-table: Generate the OID patterns natively with NumPy, which is much faster and (with --renderer native) needs no oid_orig files, or with tttool oid-code. auto (default) uses native if NumPy and Pillow are installed and the native patterns are identical to the ones of tttool, else tttool. native fails instead. This is checked once per machine, tttool version and --dpi.")
+    parser.add_option("-O", "--output-format",  type="choice", choices=["png", "pdf", "svg"], default="png", help="For -t/--build-oid-table: Write the OID table as PNG files (_oid-table0.png, ...), as one PDF file (_oid-table.pdf) or as SVG files (_oid-table0.svg, ...). PDF and SVG contain each dot pattern and shape only once, at exactly the DPI of the OIDs, and vector boxes and texts. Default is png.")
+    parser.add_option("--compact-png",  default=False, action="store_true", help="For -t/--build-oid-table: Write the boxes, labels and pages as 1 bit or palette PNG files where this is exact, with the best zlib compression, and do not anti-alias the label texts. The printed OID table looks the same, but the files are much smaller and print faster, especially at 1200 dpi.")
+    parser.add_option("-F", "--font",  type=str, default="", help="For --renderer native: TrueType font file for the label texts. Default is DejaVuSans.ttf or arial.ttf.")
+    parser.add_option("-f", "--force",  default=False, action="store_true", help="Rebuild the *.gme file and the OID table even if their inputs did not change since the last build.")
+    parser.add_option("-c", "--checksum",  default=False, action="store_true", help="Detect unchanged inputs by their contents, not only by their size and modification time.")
+    parser.add_option("-B", "--batch",  type=str, default="", help="Build all project directories (pNNN_*) below this directory instead of the current directory, --jobs of them in parallel. Each project logs into its ogg2gme.log file.")
+    parser.add_option("-a", "--transcode",  default=False, action="store_true", help="Transcode *.wav, *.flac and *.mp3 files into mono 22050 Hz *.ogg files (in parallel, see --jobs) before building. Only new or changed files are transcoded.")
+    parser.add_option("-e", "--encoder",  type=str, default="", help="For --transcode: Encoder to use. Must be ffmpeg, sox or oggenc. Default is the first one found on the PATH.")
+    parser.add_option("-q", "--audio-quality",  type=str, default="0", help="For --transcode: Ogg Vorbis quality (-1 to 10). Default is 0.")
+    parser.add_option("--cache-dir",  type=str, default="", help="Machine-wide cache directory for data which does not depend on the project (e.g. resized shapes and OID patterns). Default is $XDG_CACHE_HOME/ogg2gme or ~/.cache/ogg2gme (%LOCALAPPDATA%\\ogg2gme\\cache on Windows).")
+    parser.add_option("--cache-size",  type=int, default=256, help="Maximum size of the --cache-dir in MB. The least recently used files are removed first. Default is %default.")
+    parser.add_option("--verify-patch",  default=False, action="store_true", help="When only *.ogg files changed, the *.gme file is patched instead of running tttool assemble. With this option tttool assemble also runs and its output is compared with the patched *.gme file. (--force always runs tttool assemble.)")
+    parser.add_option("-D", "--dedup-audio",  default=False, action="store_true", help="Let scripts whose sample is identical to another sample play that other sample, so the *.gme file contains each sample only once. The OIDs do not change.")
+    parser.add_option("-w", "--watch",  default=False, action="store_true", help="Stay resident and rebuild whenever *.ogg or *.yaml files change (using inotify on Linux). Press Ctrl-C to stop.")
+    parser.add_option("--serve",  type=int, default=0, help="Run a local HTTP build service on this port (on 127.0.0.1) instead of building the current directory: Uploaded project archives (zip or tar with *.ogg and optional *.yaml files) are queued and built by --jobs worker threads. See README.md for the API. Press Ctrl-C to stop.")
+    parser.add_option("--serve-queue",  type=int, default=100, help="For --serve: Maximum number of queued jobs. Further uploads are rejected (HTTP 503) until a job starts. Default is %default.")
+    parser.add_option("-P", "--profile",  default=False, action="store_true", help="Record wall time, CPU time, bytes written and exit status of every build phase and every command and print a summary.")
+    parser.add_option("--trace",  type=str, default="", help="With --profile: Also write all phases and commands into this Chrome trace event JSON file (chrome://tracing). Implies --profile.")
     parser.add_option("-v", "--verbose",  default=0, action="count", help="Be more verbose.")
-    (options, args) = parser.parse_args()
+    return parser
+    
+    
+def main():
+    parser = createOptionParser()
+    (values, args) = parser.parse_args()
+    config = BuildConfig(**values.__dict__)
 
     if len(args) != 0:
         for arg in args:
             print "(got non-option arg '%s')" % arg
 	parser.error("Not expecting any non-option args.")
+    try:
+        checkAudioQuality(config.audio_quality)
+    except Error as e:
+        parser.error(e.message)
 
+    useConfig(config)
+    buildState.reset()
     try:
-        if not os.path.exists("_welcome.ogg"):
-            raise Error("Did not find a '_welcome.ogg' file. Please create one.")
-        
-        # Find tttool in parent dirs or PATH.
-        if not options.tttool:
-            options.tttool = "tttool" if not isWindows() else "tttool.exe"
-        tttool = findFileInParentDirs(options.tttool, options.tttool)
-        
-        (yamlFileName, codesYamlFileName) = getYamlFileNames()
-        productId = getProductId()
-        (usedScriptNames, yamlHead, yamlTail) = readOrGenerateYaml(yamlFileName, productId)
-        audioFileList = getListOfAudioFiles()
-        appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yamlHead, yamlTail)
-        buildGme(yamlFileName, tttool)
-        if options.build_oid_table:
-            buildOidTable(yamlFileName, codesYamlFileName, productId, tttool)
+        if options.batch:
+            buildBatch(options.batch)
+        elif options.serve:
+            if options.watch:
+                raise Error("--watch cannot be used with --serve.")
+            serve(options.serve)
+        elif options.watch:
+            watch(Project(".", config))
+        else:
+            Project(".", config).build()
             
     except Error as e:
         print "Error:", e.message
         sys.exit(1)
+    finally:
+        if options.profile and not options.watch and not options.serve:
+            printProfile()
+            if options.trace:
+                writeTrace(options.trace)
 
     
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# test_gme_patch.py - Regression test: A *.gme file patched with changed audio
+#                     files is identical to the output of a full tttool assemble.
+#
+# The tests are skipped if tttool is not installed: Only the output of the real
+# tttool shows whether the patched *.gme files match it.
+#
+# Run with: python -m unittest discover -s tests
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import distutils.spawn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import ogg2gme
+
+
+tttool = distutils.spawn.find_executable("tttool")
+
+
+@unittest.skipUnless(tttool, "requires tttool")
+class GmePatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="ogg2gme-test-")
+        self.projectDir = self.tmpDir + "/p901_patch"
+        os.mkdir(self.projectDir)
+        self.sample = ogg2gme.readStringFromFile(ogg2gme.dataDir + "/STOP.ogg")
+        # Unlike STOP.ogg, whose contents are the same as the sample.
+        self.writeSample("_welcome.ogg", self.sample + "welcome")
+        for i in range(5):
+            self.writeSample("sample%d.ogg" % i, self.sample + "sample%d" % i * (i + 1))
+        self.config = ogg2gme.BuildConfig(tttool=tttool, jobs=1, cache_dir=self.tmpDir + "/cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeSample(self, fileName, data):
+        ogg2gme.writeStringToFile(self.projectDir + "/" + fileName, data)
+        # The mtime has a resolution of one second on some file systems.
+        stat = os.stat(self.projectDir + "/" + fileName)
+        os.utime(self.projectDir + "/" + fileName, (stat.st_atime, stat.st_mtime + 10))
+
+    def buildAndCompare(self):
+        """Build the project, which must patch the *.gme file, and compare it with the output of tttool assemble.
+        """
+        result = ogg2gme.Project(self.projectDir, self.config).build()
+        self.assertTrue(result.gmeBuilt)
+        self.assertIn("patch", result.phaseTimes)
+        self.assertNotIn("assemble", result.phaseTimes)
+        assembledFileName = self.tmpDir + "/assembled.gme"
+        ogg2gme.buildGme(result.yamlFileName, tttool, assembledFileName)
+        self.assertEqual(ogg2gme.readStringFromFile(result.gmeFileName), ogg2gme.readStringFromFile(assembledFileName))
+
+    def testSameSizeReplacement(self):
+        ogg2gme.Project(self.projectDir, self.config).build()
+        self.writeSample("sample2.ogg", self.sample + "SAMPLE2" * 3)
+        self.buildAndCompare()
+
+    def testSizeChangingReplacement(self):
+        ogg2gme.Project(self.projectDir, self.config).build()
+        self.writeSample("sample1.ogg", self.sample + "longer" * 100)
+        self.writeSample("sample3.ogg", self.sample[:len(self.sample) / 2])
+        self.buildAndCompare()
+
+    def testWelcomeReplacement(self):
+        ogg2gme.Project(self.projectDir, self.config).build()
+        self.writeSample("_welcome.ogg", self.sample + "new welcome")
+        self.buildAndCompare()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# test_oid_code.py - Regression test: The native OID patterns (--oid-generator
+#                    native) are identical to the ones of tttool oid-code.
+#
+# The tests are skipped if NumPy, Pillow or (for the comparison) tttool are not installed.
+#
+# Run with: python -m unittest discover -s tests
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import distutils.spawn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import ogg2gme
+
+
+# Oids with all digit values at all positions, the start oids of products and the oids of scripts.
+testOids = [0, 1, 2, 3, 4, 5, 15, 16, 255, 256, 901, 950, 1001, 1002, 1234, 4711, 9999, 12345, 14999]
+
+tttool = distutils.spawn.find_executable("tttool")
+
+
+@unittest.skipUnless(ogg2gme.numpy and ogg2gme.Image, "requires NumPy and Pillow")
+class OidCodeTest(unittest.TestCase):
+    def setUp(self):
+        ogg2gme.useConfig(ogg2gme.BuildConfig())
+        self.tmpDir = tempfile.mkdtemp(prefix="ogg2gme-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    @unittest.skipUnless(tttool, "requires tttool")
+    def testPatternsAreIdenticalToTttool(self):
+        for dpi in ("600", "600d", "1200", "1200d"):
+            ogg2gme.options.dpi = dpi
+            dirName = self.tmpDir + "/" + dpi
+            os.mkdir(dirName)
+            ogg2gme.generateOids(testOids, dirName, tttool)
+            for oid in testOids:
+                self.assertTrue(ogg2gme.isOidImageIdentical(dirName + "/oid-%d.png" % oid, ogg2gme.getOidPixels(oid, dpi)),
+                                "oid %d differs at %s dpi" % (oid, dpi))
+
+    @unittest.skipUnless(tttool, "requires tttool")
+    def testCheckOidGenerator(self):
+        ogg2gme.options.cache_dir = self.tmpDir + "/cache"
+        ogg2gme.options.dpi = "1200d"
+        self.assertTrue(ogg2gme.checkOidGenerator(tttool))
+
+    def testInMemoryPatternIsRenderedLikeFile(self):
+        layout = {"boxInnerSize": (330, 330), "boxTotalSize": (376, 376), "boxBorderWidth": 23, "boxBorderColor": "red",
+                  "columnWidth": 1495, "textPointSize": 72, "textOffset": 399, "labelBorderWidth": 11, "font": "",
+                  "compact": False, "oidDpi": "600d"}
+        oidFileName = self.tmpDir + "/oid-1001.png"
+        ogg2gme.writeOidNative(1001, "600d", oidFileName)
+        try:
+            ogg2gme.loadFontNative(layout["font"], layout["textPointSize"])
+        except IOError as e:
+            self.skipTest(str(e))
+        for (name, origOid) in (("file", oidFileName), ("memory", 1001)):
+            ogg2gme.renderOidNative(origOid, self.tmpDir + "/box-%s.png" % name, self.tmpDir + "/label-%s.png" % name, "test", None, layout)
+        for prefix in ("box", "label"):
+            (fromFile, fromMemory) = [ogg2gme.Image.open(self.tmpDir + "/%s-%s.png" % (prefix, x)) for x in ("file", "memory")]
+            self.assertEqual(list(fromFile.getdata()), list(fromMemory.getdata()))
+
+
+if __name__ == "__main__":
+    unittest.main()
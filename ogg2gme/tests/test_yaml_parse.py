@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# test_yaml_parse.py - Regression test: Reading and extending the *.yaml file of
+#                      very large projects keeps its text.
+#
+# Run with: python -m unittest discover -s tests
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import ogg2gme
+
+
+yamlHeadTemplate = """# Generated for the regression test
+product-id: 901
+welcome: _welcome
+scripts:
+"""
+
+# Blank and comment lines after the scripts still belong to the script section (and to yamlHead).
+yamlEndOfScripts = """
+# Settings after the scripts
+"""
+
+yamlTail = """media-path: audio/%s.ogg
+language: de
+"""
+
+
+def makeYaml(numScripts, newline="\n"):
+    """Return (text, expectedScriptNames, expectedHead, expectedTail) of a synthetic *.yaml file with numScripts scripts.
+    """
+    names = ["sample%d" % i for i in range(numScripts)]
+    scripts = []
+    for (i, name) in enumerate(names):
+        if i % 1000 == 0:
+            scripts.append("  # Chapter %d\n" % (i / 1000))
+        scripts.append("  %s:\n  - P(%s)\n" % (name, name))
+    head = yamlHeadTemplate + "".join(scripts) + yamlEndOfScripts
+    return ((head + yamlTail).replace("\n", newline), set(names), head, yamlTail)
+
+
+class YamlParseTest(unittest.TestCase):
+    def setUp(self):
+        ogg2gme.useConfig(ogg2gme.BuildConfig())
+        self.tmpDir = tempfile.mkdtemp(prefix="ogg2gme-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeYaml(self, text, name="p901_test.yaml"):
+        fileName = self.tmpDir + "/" + name
+        ogg2gme.writeStringToFile(fileName, text)
+        return fileName
+
+    def testLargeYamlIsParsedCorrectly(self):
+        (text, names, head, tail) = makeYaml(50000)
+        (usedScriptNames, yamlHead, yamlTail) = ogg2gme.readOrGenerateYaml(self.writeYaml(text), 901)
+        self.assertEqual(usedScriptNames, names)
+        self.assertEqual(yamlHead, head)
+        self.assertEqual(yamlTail, tail)
+
+    def testCrLfYamlIsParsedLikeLf(self):
+        (text, names, head, tail) = makeYaml(50000, "\r\n")
+        (usedScriptNames, yamlHead, yamlTail) = ogg2gme.readOrGenerateYaml(self.writeYaml(text), 901)
+        self.assertEqual(usedScriptNames, names)
+        self.assertEqual(yamlHead, head)
+        self.assertEqual(yamlTail, tail)
+
+    def testOnlyNewSamplesAreAppended(self):
+        (text, names, head, tail) = makeYaml(50000)
+        yamlFileName = self.writeYaml(text)
+        (usedScriptNames, yamlHead, yamlTail) = ogg2gme.readOrGenerateYaml(yamlFileName, 901)
+        audioFileList = [self.tmpDir + "/%s.ogg" % x for x in ["_welcome"] + sorted(names) + ["new%d" % i for i in range(10)]]
+        ogg2gme.appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yamlHead, yamlTail)
+        expected = head + "".join(["  new%d:\n  - P(new%d)\n" % (i, i) for i in range(10)]) + tail
+        self.assertEqual(ogg2gme.readStringFromFile(yamlFileName), expected)
+        self.assertEqual(ogg2gme.readOrGenerateYaml(yamlFileName, 901)[0], names | set(["new%d" % i for i in range(10)]))
+
+    def testFileIsReadAndWrittenOnce(self):
+        # Reading 50000 scripts and appending new ones reads and writes the file once, not once per script.
+        (text, names, head, tail) = makeYaml(50000)
+        yamlFileName = self.writeYaml(text)
+        calls = []
+        (readStringFromFile, writeStringToFile) = (ogg2gme.readStringFromFile, ogg2gme.writeStringToFile)
+        ogg2gme.readStringFromFile = lambda *args: calls.append("read") or readStringFromFile(*args)
+        ogg2gme.writeStringToFile = lambda *args: calls.append("write") or writeStringToFile(*args)
+        try:
+            (usedScriptNames, yamlHead, yamlTail) = ogg2gme.readOrGenerateYaml(yamlFileName, 901)
+            audioFileList = [self.tmpDir + "/%s.ogg" % x for x in sorted(names) + ["new"]]
+            ogg2gme.appendNewObjectCodesToYaml(yamlFileName, usedScriptNames, audioFileList, yamlHead, yamlTail)
+        finally:
+            (ogg2gme.readStringFromFile, ogg2gme.writeStringToFile) = (readStringFromFile, writeStringToFile)
+        self.assertEqual(calls, ["read", "write"])
+
+
+if __name__ == "__main__":
+    unittest.main()